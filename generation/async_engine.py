@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import threading
+import time
+
+from tqdm import tqdm
+
+import governor
+import metrics
+import openai_api
+
+
+_DONE = object()
+
+
+# Producer for streaming runs: pulls chunks from a (possibly slow, blocking) iterator in a thread and
+# feeds them into a bounded queue, so parsing and API calls overlap and memory stays bounded
+def _produce(chunks, queue, loop, consumers, stop):
+    try:
+        for chunk in chunks:
+            if stop.is_set():
+                break
+            asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+    finally:
+        for _ in range(consumers):
+            asyncio.run_coroutine_threadsafe(queue.put(_DONE), loop).result()
+
+
+# Function to run `process_chunk` over every chunk with at most `concurrency` requests in flight.
+# Each finished chunk is passed to `on_result(chunk, items)` as soon as it completes, so output
+# reaches the writer in completion order while every record stays tied to the chunk it came from.
+# With `queue_size` set, `chunks` may be a lazy iterator that is consumed through a bounded queue.
+async def run_chunks(chunks, process_chunk, on_result, concurrency=None, desc='Generating', queue_size=None):
+    concurrency = concurrency or openai_api.CONFIG["concurrency"]
+    total = len(chunks) if hasattr(chunks, '__len__') else None
+    stats = {"chunks": 0, "items": 0, "failed": 0, "first_result": None}
+    progress = tqdm(total=total, desc=desc)
+    start = time.perf_counter()
+
+    producer = None
+    stop = threading.Event()
+    if queue_size:
+        queue = asyncio.Queue(maxsize=queue_size)
+        loop = asyncio.get_running_loop()
+        producer = loop.run_in_executor(None, _produce, chunks, queue, loop, concurrency, stop)
+        next_chunk = queue.get
+    else:
+        # All workers pull from the same iterator; `next` never awaits, so no chunk is handed out twice
+        iterator = iter(chunks)
+
+        async def next_chunk():
+            return next(iterator, _DONE)
+
+    async def worker():
+        while (chunk := await next_chunk()) is not _DONE:
+            metrics.current_source.set(chunk.metadata.get('source'))
+            try:
+                items = await process_chunk(chunk)
+            except governor.FatalAPIError:
+                # Every other chunk would fail the same way
+                raise
+            except Exception as e:
+                logging.error(f"Chunk from {chunk.metadata.get('source')} failed: {e}")
+                items = None
+            stats["chunks"] += 1
+            metrics.run.observe_chunk(chunk.metadata.get('source'), None if items is None else len(items))
+            # None marks a failed chunk; an empty list is a finished chunk that produced nothing
+            if items is None:
+                stats["failed"] += 1
+            else:
+                stats["items"] += len(items)
+                on_result(chunk, items)
+                if stats["first_result"] is None:
+                    stats["first_result"] = time.perf_counter() - start
+            progress.update(1)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        if producer:
+            await producer
+    finally:
+        # If the workers stopped early, unblock the producer so its thread can exit
+        if producer and not producer.done():
+            stop.set()
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0.01)
+        progress.close()
+    stats["elapsed"] = time.perf_counter() - start
+    report_throughput(stats, concurrency)
+    return stats
+
+
+# Function to log chunk and item throughput for a finished run
+def report_throughput(stats, concurrency):
+    elapsed = max(stats["elapsed"], 1e-9)
+    logging.info(
+        f"Processed {stats['chunks']} chunks ({stats['failed']} failed) into {stats['items']} items "
+        f"in {elapsed:.1f}s with {concurrency} requests in flight: "
+        f"{stats['chunks'] / elapsed:.2f} chunks/s, {stats['items'] / elapsed:.2f} items/s"
+    )
+    if stats["first_result"] is not None:
+        logging.info(f"First result written after {stats['first_result']:.1f}s")
+
+
+# Synchronous entry point for the `__main__` blocks of the generation scripts
+def run(chunks, process_chunk, on_result, concurrency=None, desc='Generating', queue_size=None):
+    return asyncio.run(run_chunks(chunks, process_chunk, on_result, concurrency, desc, queue_size))
@@ -0,0 +1,127 @@
+import glob
+import json
+import logging
+import os
+
+from langchain.docstore.document import Document
+
+# Limits of the provider's batch endpoint per input file
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+
+
+def build_request(custom_id, sys_prompt, user_prompt, model):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": sys_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+        }
+    }
+
+
+# Writes batch request files `<name>_requests_00000.jsonl`, ... into `batch_dir`, starting a new shard at the
+# provider's per-file limits, plus a `<name>_meta.jsonl` sidecar holding what ingest needs for each custom_id.
+# custom_ids must be unique across a batch, so a request whose custom_id was already added is skipped.
+class BatchExporter:
+    def __init__(self, batch_dir, name, model, max_requests=MAX_REQUESTS_PER_FILE, max_bytes=MAX_BYTES_PER_FILE):
+        self.batch_dir = batch_dir
+        self.name = name
+        self.model = model
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.requests = 0
+        self.duplicates = 0
+        self._seen = set()
+        self._file = None
+        self._meta = None
+        self._shard_requests = 0
+        self._shard_bytes = 0
+        os.makedirs(batch_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(batch_dir, f'{name}_requests_*.jsonl')):
+            os.remove(stale)
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        path = os.path.join(self.batch_dir, f'{self.name}_requests_{len(self.shards):05d}.jsonl')
+        self.shards.append(path)
+        self._file = open(path, 'w', encoding='utf-8')
+        self._shard_requests = 0
+        self._shard_bytes = 0
+
+    def add(self, custom_id, sys_prompt, user_prompt, meta=None):
+        if custom_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(custom_id)
+        line = json.dumps(build_request(custom_id, sys_prompt, user_prompt, self.model), ensure_ascii=False) + "\n"
+        size = len(line.encode('utf-8'))
+        if (self._file is None or self._shard_requests >= self.max_requests
+                or self._shard_bytes + size > self.max_bytes):
+            self._rotate()
+        self._file.write(line)
+        self._shard_requests += 1
+        self._shard_bytes += size
+        self.requests += 1
+        if meta is not None:
+            if self._meta is None:
+                self._meta = open(os.path.join(self.batch_dir, f'{self.name}_meta.jsonl'), 'w', encoding='utf-8')
+            self._meta.write(json.dumps({"custom_id": custom_id, **meta}, ensure_ascii=False) + "\n")
+        return True
+
+    def close(self):
+        for file in (self._file, self._meta):
+            if file:
+                file.close()
+        logging.info(f"Exported {self.requests} batch requests for {self.name} into {len(self.shards)} files "
+                     f"in {self.batch_dir}")
+        if self.duplicates:
+            logging.warning(f"Skipped {self.duplicates} requests for {self.name} whose custom_id was already exported")
+        return self.shards
+
+
+def load_meta(batch_dir, name):
+    meta = {}
+    path = os.path.join(batch_dir, f'{name}_meta.jsonl')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                record = json.loads(line)
+                meta[record.pop("custom_id")] = record
+    return meta
+
+
+# Function to read every downloaded result file in `<batch_dir>/results`; yields (custom_id, content, error)
+# where content is the completion text, or None with an error message for failed requests
+def read_results(batch_dir):
+    for path in sorted(glob.glob(os.path.join(batch_dir, 'results', '*.jsonl'))):
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    yield record["custom_id"], None, str(record.get("error") or response.get("body"))
+                    continue
+                try:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                except (KeyError, IndexError, TypeError):
+                    yield record["custom_id"], None, f"malformed response body: {response.get('body')}"
+                    continue
+                yield record["custom_id"], content, None
+
+
+def chunk_to_meta(chunk):
+    return {"page_content": chunk.page_content, "metadata": chunk.metadata}
+
+
+def meta_to_chunk(meta):
+    return Document(page_content=meta["page_content"], metadata=meta["metadata"])
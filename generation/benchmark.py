@@ -0,0 +1,201 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import load_data
+import mock_llm
+import shards as shards_module
+
+GENERATION_DIR = os.path.dirname(os.path.abspath(__file__))
+# Script, report name (as written by metrics.run.write) and kind of input of each benchmarked pipeline
+TARGETS = {
+    'qa': (os.path.join(GENERATION_DIR, 'qa_generation.py'), 'qa', 'docs'),
+    'script': (os.path.join(GENERATION_DIR, 'script_format_generation.py'), 'script', 'docs'),
+    'process': (os.path.join(GENERATION_DIR, '..', 'trans_format', 'process_data.py'), 'process', 'csv'),
+}
+
+_TERMS = ['timing', 'placement', 'routing', 'netlist', 'liberty', 'floorplan', 'clock tree', 'power grid',
+          'congestion', 'slack', 'macro', 'standard cell', 'synthesis', 'DRC', 'parasitics', 'hold fix']
+_COMMANDS = ['set_clock_uncertainty -setup {v} [get_clocks clk]', 'read_liberty -corner ss {n}.lib',
+             'global_placement -density 0.{v}', 'detailed_route -output_drc {n}.rpt',
+             'report_checks -path_delay max -group_count {v}', 'pdngen::add_stripe -width {v} -pitch 20',
+             'set_wire_rc -signal -layer metal{v}', 'clock_tree_synthesis -root_buf BUF_X{v}']
+
+
+def _sentence(rng):
+    return f"The {rng.choice(_TERMS)} step updates the {rng.choice(_TERMS)} of the design " \
+           f"so that {rng.choice(_TERMS)} stays within the {rng.choice(_TERMS)} budget."
+
+
+# Function to write a synthetic Markdown corpus of `documents` files spread over the tools in load_data.doc_list.
+# Every other document carries a code block of Tcl commands, so script generation finds both kinds of chunks.
+def write_corpus(data_dir, documents, seed=0, paragraphs=12):
+    rng = random.Random(seed)
+    for number in range(documents):
+        source = load_data.doc_list[number % len(load_data.doc_list)]
+        os.makedirs(os.path.join(data_dir, source), exist_ok=True)
+        parts = [f"# {source} {rng.choice(_TERMS)} guide {number}"]
+        for _ in range(paragraphs):
+            parts.append(' '.join(_sentence(rng) for _ in range(rng.randint(3, 8))))
+            if number % 2 == 0 and rng.random() < 0.3:
+                commands = rng.sample(_COMMANDS, 3)
+                parts.append('```\n' + '\n'.join(command.format(v=rng.randint(1, 9), n=f'{source}_{number}')
+                                                  for command in commands) + '\n```')
+        with open(os.path.join(data_dir, source, f'doc_{number:05d}.md'), 'w', encoding='utf-8') as file:
+            file.write('\n\n'.join(parts))
+
+
+# Function to write the two CSV kinds process_data.py converts, `rows` rows each
+def write_csvs(csv_dir, rows, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(csv_dir, exist_ok=True)
+    with open(os.path.join(csv_dir, 'Question-Answer.csv'), 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Prompts', 'Answers'])
+        for _ in range(rows):
+            writer.writerow([f"What is {rng.choice(_TERMS)} in OpenROAD?", ' '.join(_sentence(rng) for _ in range(4))])
+    with open(os.path.join(csv_dir, 'Prompt-Script.csv'), 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['prompt', 'code'])
+        for row in range(rows):
+            writer.writerow([f"Template of {rng.choice(_TERMS)}",
+                             rng.choice(_COMMANDS).format(v=rng.randint(1, 9), n=f'design_{row}')])
+
+
+def _wait(process):
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return process.returncode, usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+# Function to run one pipeline as a subprocess against the mock server and collect its throughput, latency and
+# peak RSS; chunk and latency figures come from the run report the pipeline writes itself. With `shards` > 1 the
+# generation scripts run as that many concurrent `--shard I/N` workers and their reports are combined.
+def run_target(name, input_dir, output_dir, url, concurrency, extra_args=(), shards=1):
+    script, report_name, _ = TARGETS[name]
+    input_flag = '--input-path' if name == 'process' else '--data-path'
+    command = [sys.executable, script, input_flag, input_dir, '--output-path', output_dir,
+               '--concurrency', str(concurrency), *extra_args]
+    env = dict(os.environ, OPENAI_API_URL=url, OPENAI_API_KEY='mock', OPENAI_CACHE_MODE='off')
+    os.makedirs(output_dir, exist_ok=True)
+    workers = [command + ['--shard', f'{index}/{shards}'] for index in range(shards)] if shards > 1 else [command]
+    logs = [open(os.path.join(output_dir, f'{name}-{index}.log'), 'w', encoding='utf-8')
+            for index in range(len(workers))]
+    start = time.perf_counter()
+    processes = [subprocess.Popen(worker, cwd=os.path.dirname(script), env=env, stdout=log, stderr=subprocess.STDOUT)
+                 for worker, log in zip(workers, logs)]
+    results = [_wait(process) for process in processes]
+    seconds = time.perf_counter() - start
+    for log in logs:
+        log.close()
+    for index, (returncode, _) in enumerate(results):
+        if returncode:
+            raise RuntimeError(f"{name} exited with {returncode}; see {output_dir}/{name}-{index}.log")
+
+    report_dirs = [os.path.join(output_dir, shards_module.shard_dir(index, shards)) for index in range(shards)] \
+        if shards > 1 else [output_dir]
+    reports = []
+    for report_dir in report_dirs:
+        with open(os.path.join(report_dir, f'{report_name}_run_report.json'), 'r', encoding='utf-8') as file:
+            reports.append(json.load(file))
+    chunks = sum(source["chunks"] for report in reports for source in report["by_source"].values())
+    peak_rss = [rss for _, rss in results if rss is not None]
+    tokens = Counter()
+    for report in reports:
+        for model_tokens in report["tokens"].values():
+            tokens.update(model_tokens)
+
+    def total(name):
+        return sum(report["totals"].get(name, 0) for report in reports)
+
+    def worst(name):
+        values = [report[name] for report in reports if report[name] is not None]
+        return max(values) if values else None
+
+    return {
+        "target": name,
+        "shards": shards,
+        "seconds": seconds,
+        "chunks": chunks,
+        "failed_chunks": total("failed_chunks"),
+        "items": sum(source["items"] for report in reports for source in report["by_source"].values()),
+        "chunks_per_s": chunks / seconds,
+        "requests": sum(report["requests"] for report in reports),
+        # Per-worker percentiles cannot be combined exactly; the slowest worker's are reported
+        "latency_p50_s": worst("latency_p50"),
+        "latency_p99_s": worst("latency_p99"),
+        "prompt_tokens_per_chunk": tokens["prompt_tokens"] / chunks if chunks else None,
+        "completion_tokens_per_chunk": tokens["completion_tokens"] / chunks if chunks else None,
+        "prompt_cache_hit_ratio": tokens["cached_tokens"] / tokens["prompt_tokens"] if tokens["prompt_tokens"] else None,
+        "retries": total("retries"),
+        "parse_failures": total("parse_failures"),
+        "request_errors": total("request_errors"),
+        "peak_rss_mb": max(peak_rss) if peak_rss else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure end-to-end pipeline throughput against a local mock LLM')
+    parser.add_argument('--targets', nargs='+', choices=sorted(TARGETS), default=['qa', 'script', 'process'])
+    parser.add_argument('--documents', type=int, default=200, help='Synthetic Markdown documents to generate from')
+    parser.add_argument('--rows', type=int, default=200, help='Rows per synthetic CSV for process_data.py')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, default=200, help='Median mock request latency')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Sigma of the log-normal latency')
+    parser.add_argument('--rate-limit', type=float, default=0.01, help='Fraction of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+    parser.add_argument('--malformed', type=float, default=0.05, help='Fraction of completions with broken JSON')
+    parser.add_argument('--prefix-cache-min-tokens', type=int, default=1024,
+                        help='Shortest prompt the mock\'s prefix cache serves (OpenAI: 1024; 0 for vLLM-style caching)')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Run the generation scripts as this many concurrent --shard I/N workers')
+    parser.add_argument('--pipeline-args', default='',
+                        help='Extra options for qa_generation.py / script_format_generation.py, e.g. "--stream"')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help='Keep the corpus and outputs here instead of a temp dir')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        data_dir, csv_dir = os.path.join(work_dir, 'corpus'), os.path.join(work_dir, 'csv')
+        write_corpus(data_dir, args.documents, args.seed)
+        write_csvs(csv_dir, args.rows, args.seed)
+
+        results = []
+        with mock_llm.MockLLMServer(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                                    rate_limit_rate=args.rate_limit, error_rate=args.error_rate,
+                                    malformed_rate=args.malformed, seed=args.seed,
+                                    prefix_cache_min_tokens=args.prefix_cache_min_tokens) as server:
+            for name in args.targets:
+                served = dict(server.stats)
+                docs = TARGETS[name][2] == 'docs'
+                extra_args = shlex.split(args.pipeline_args) if docs else []
+                result = run_target(name, data_dir if docs else csv_dir, os.path.join(work_dir, 'output', name),
+                                    server.url, args.concurrency, extra_args, args.shards if docs else 1)
+                result["mock"] = {key: count - served.get(key, 0) for key, count in server.stats.items()}
+                results.append(result)
+                p50, p99 = result["latency_p50_s"] or 0, result["latency_p99_s"] or 0
+                logging.info(f"{name}: {result['chunks']} chunks ({result['failed_chunks']} failed) in "
+                             f"{result['seconds']:.1f}s = {result['chunks_per_s']:.2f} chunks/s; "
+                             f"{result['requests']} requests, p50 {p50 * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms; "
+                             f"{result['prompt_tokens_per_chunk'] or 0:.0f} prompt tokens per chunk, "
+                             f"{result['prompt_cache_hit_ratio'] or 0:.0%} cached; "
+                             f"peak RSS {result['peak_rss_mb'] or 0:.0f} MB; mock served {result['mock']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({"settings": vars(args), "results": results}, file, indent=2)
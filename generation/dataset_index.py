@@ -0,0 +1,202 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sys
+
+import numpy as np
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# Fields with postings lists in the sidecar index
+INDEX_FIELDS = ('source', 'type', 'topic')
+# Bytes hashed at the start of the dataset and before the last indexed offset to tell an appended dataset
+# from a rewritten one
+_CHECK_BYTES = 4096
+
+
+# Sidecar files of `<stem>.jsonl`: record byte ranges, concatenated postings and the JSON metadata that maps
+# every field value to its slice of the postings array
+def index_paths(path):
+    stem, _ = os.path.splitext(path)
+    return f'{stem}.offsets.npy', f'{stem}.postings.npy', f'{stem}.index.json'
+
+
+def _range_hash(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        return hashlib.sha256(file.read(end - start)).hexdigest()
+
+
+# Function to tell whether the bytes indexed by `meta` are still the start of the dataset. A dataset that grew
+# must keep the same bytes at its start and before the last indexed offset; one that did not grow must also
+# keep its modification time, since an in-place rewrite can keep both ends.
+def _unchanged_prefix(path, meta, stat):
+    indexed = meta['size']
+    if indexed > stat.st_size:
+        return False
+    if stat.st_size <= meta.get('file_size', -1) and stat.st_mtime_ns != meta.get('mtime_ns'):
+        return False
+    return (meta['head'] == _range_hash(path, 0, min(indexed, _CHECK_BYTES))
+            and meta.get('tail') == _range_hash(path, max(0, indexed - _CHECK_BYTES), indexed))
+
+
+def _load_meta(path):
+    offsets_path, postings_path, meta_path = index_paths(path)
+    if not all(os.path.exists(p) for p in (offsets_path, postings_path, meta_path)):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+# Function to build or refresh the sidecar index of a JSONL dataset. An unchanged dataset is not read again and
+# a dataset that was only appended to is indexed from where the last build stopped; anything else is rebuilt.
+# A partial last line (a writer still running) is left for the next refresh.
+def build_index(path, fields=INDEX_FIELDS):
+    offsets_path, postings_path, meta_path = index_paths(path)
+    stat = os.stat(path)
+    size = stat.st_size
+    meta = _load_meta(path)
+    offsets = []
+    postings = {field: {} for field in fields}
+    position = 0
+    if meta and meta['fields'] == list(fields) and _unchanged_prefix(path, meta, stat):
+        if meta['size'] == size:
+            return meta
+        offsets = np.load(offsets_path).tolist()
+        stored = np.load(postings_path)
+        for field, values in meta['postings'].items():
+            for value, (start, end) in values.items():
+                postings[field][value] = stored[start:end].tolist()
+        position = meta['size']
+
+    skipped = 0
+    with open(path, 'rb') as file:
+        file.seek(position)
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            start, position = position, position + len(line)
+            if not line.strip():
+                continue
+            try:
+                record = loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            row = len(offsets)
+            offsets.append((start, position))
+            for field in fields:
+                value = record.get(field)
+                if isinstance(value, (str, int, float, bool)):
+                    postings[field].setdefault(str(value), []).append(row)
+    if skipped:
+        logging.warning(f"Skipped {skipped} lines of {path} that are not valid JSON")
+
+    rows, slices, total = [], {}, 0
+    for field, values in postings.items():
+        slices[field] = {}
+        for value, ids in sorted(values.items()):
+            rows.append(ids)
+            slices[field][value] = [total, total + len(ids)]
+            total += len(ids)
+    np.save(offsets_path, np.asarray(offsets, dtype=np.int64).reshape(-1, 2))
+    np.save(postings_path, np.fromiter((row for ids in rows for row in ids), dtype=np.int64))
+    meta = {"fields": list(fields), "size": position, "head": _range_hash(path, 0, min(position, _CHECK_BYTES)),
+            "tail": _range_hash(path, max(0, position - _CHECK_BYTES), position),
+            "file_size": size, "mtime_ns": stat.st_mtime_ns, "records": len(offsets), "postings": slices}
+    with open(meta_path, 'w', encoding='utf-8') as file:
+        json.dump(meta, file, ensure_ascii=False)
+    logging.info(f"Indexed {len(offsets)} records of {path}")
+    return meta
+
+
+# Random access to a JSONL dataset through its sidecar index. The dataset and the index arrays are memory-mapped,
+# filters are answered from the postings, and only the records that are actually returned get decoded.
+class DatasetReader:
+    def __init__(self, path, fields=INDEX_FIELDS):
+        self.path = path
+        self.meta = build_index(path, fields)
+        offsets_path, postings_path, _ = index_paths(path)
+        self.offsets = np.load(offsets_path, mmap_mode='r') if self.meta['records'] else np.empty((0, 2), np.int64)
+        self.postings = np.load(postings_path, mmap_mode='r') if self.meta['records'] else np.empty(0, np.int64)
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.meta['size'] else b''
+
+    def __len__(self):
+        return self.meta['records']
+
+    def __getitem__(self, row):
+        start, end = self.offsets[row]
+        return loads(self._map[start:end])
+
+    # Function to return the value counts of an indexed field
+    def values(self, field):
+        return {value: end - start for value, (start, end) in self._field(field).items()}
+
+    def _field(self, field):
+        if field not in self.meta['postings']:
+            raise ValueError(f"Field {field!r} is not indexed, expected one of {self.meta['fields']}")
+        return self.meta['postings'][field]
+
+    # Function to return the sorted rows matching every filter; a filter value may be a list of accepted values
+    def select(self, **filters):
+        rows = None
+        for field, wanted in filters.items():
+            postings = self._field(field)
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            matches = [self.postings[slice(*postings[str(value)])] for value in wanted if str(value) in postings]
+            matches = np.unique(np.concatenate(matches)) if matches else np.empty(0, np.int64)
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+        return np.arange(len(self)) if rows is None else rows
+
+    def records(self, rows):
+        for row in rows:
+            yield self[row]
+
+    def filter(self, **filters):
+        return self.records(self.select(**filters))
+
+    def sample(self, n, seed=None, **filters):
+        rows = self.select(**filters)
+        rng = np.random.default_rng(seed)
+        return list(self.records(rng.choice(rows, size=min(n, len(rows)), replace=False)))
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index a generated JSONL dataset and print the matching records')
+    parser.add_argument('dataset')
+    for field in INDEX_FIELDS:
+        parser.add_argument(f'--{field}', action='append', default=None, help=f'Keep records with this {field}')
+    parser.add_argument('--sample', type=int, default=None, help='Print N random matching records')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stats', action='store_true', help='Print the value counts of the indexed fields')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with DatasetReader(args.dataset) as reader:
+        if args.stats:
+            print(json.dumps({field: reader.values(field) for field in INDEX_FIELDS}, ensure_ascii=False, indent=2))
+        else:
+            filters = {field: getattr(args, field) for field in INDEX_FIELDS if getattr(args, field)}
+            records = (reader.sample(args.sample, args.seed, **filters) if args.sample
+                       else reader.filter(**filters))
+            for record in records:
+                sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
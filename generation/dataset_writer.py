@@ -0,0 +1,158 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import metrics
+
+# Durability policies:
+#   none  - data reaches the OS only when a batch fills up, on rotation and on close
+#   flush - every batch is flushed to the OS as soon as it is written (survives a killed process)
+#   fsync - every batch is flushed and fsync'ed (survives a power loss)
+DURABILITY = ('none', 'flush', 'fsync')
+
+
+def dumps(record) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY)
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+
+
+# Buffered JSONL dataset writer with one long-lived handle, batched writes and optional shard rotation.
+# Records are buffered in memory and written `batch_size` at a time, or by the first write that arrives once
+# `flush_interval` seconds have passed since the last batch. There is no timer: records written before a long
+# pause stay buffered until the next write, flush() or close().
+# With `max_records` / `max_bytes` set, output goes to `<stem>-00000.jsonl`, `<stem>-00001.jsonl`, ...
+# Callbacks passed to write_many run once the records are flushed, e.g. to mark a chunk as done only after
+# its items are on disk. All methods are thread-safe.
+class DatasetWriter:
+    def __init__(self, path, batch_size=256, flush_interval=1.0, max_records=None, max_bytes=None,
+                 durability='flush', append=True):
+        if durability not in DURABILITY:
+            raise ValueError(f"Unknown durability policy {durability!r}, expected one of {DURABILITY}")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.durability = durability
+        self.records = 0
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._callbacks = []
+        self._last_flush = time.monotonic()
+        self._file = None
+        self._shard = 0
+        self._shard_records = 0
+        self._shard_bytes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._open(append)
+
+    @property
+    def sharded(self):
+        return bool(self.max_records or self.max_bytes)
+
+    def shard_path(self, shard):
+        stem, ext = os.path.splitext(self.path)
+        return f'{stem}-{shard:05d}{ext}'
+
+    def shard_paths(self):
+        if not self.sharded:
+            return [self.path]
+        stem, ext = os.path.splitext(self.path)
+        pattern = re.compile(re.escape(os.path.basename(stem)) + r'-\d{5}' + re.escape(ext) + '$')
+        return sorted(path for path in glob.glob(f'{glob.escape(stem)}-*{ext}') if pattern.search(path))
+
+    def _open(self, append):
+        path = self.path
+        if self.sharded:
+            existing = self.shard_paths()
+            if not append:
+                for stale in existing:
+                    os.remove(stale)
+                existing = []
+            # Appending continues in the last shard
+            self._shard = int(re.search(r'-(\d{5})\.?\w*$', existing[-1]).group(1)) if existing else 0
+            path = self.shard_path(self._shard)
+        self._file = open(path, 'ab' if append else 'wb')
+        self._shard_bytes = self._file.tell()
+        self._shard_records = 0
+        if append and self.max_records and self._shard_bytes:
+            with open(path, 'rb') as file:
+                self._shard_records = sum(1 for _ in file)
+
+    def _rotate(self):
+        self._file.close()
+        self._shard += 1
+        self._file = open(self.shard_path(self._shard), 'wb')
+        self._shard_records = 0
+        self._shard_bytes = 0
+
+    def write(self, record):
+        self.write_many([record])
+
+    def write_many(self, records, callback=None):
+        with self._lock:
+            lines = [dumps(record) for record in records]
+            self._buffer.extend(lines)
+            self.records += len(lines)
+            if callback is not None:
+                self._callbacks.append(callback)
+            if (len(self._buffer) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                callbacks = self._flush()
+            else:
+                callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def _flush(self):
+        start = time.perf_counter()
+        if not self.sharded:
+            self._file.write(b''.join(self._buffer))
+            self._buffer = []
+        for line in self._buffer:
+            if self.sharded and self._shard_records and (
+                    (self.max_records and self._shard_records >= self.max_records)
+                    or (self.max_bytes and self._shard_bytes + len(line) > self.max_bytes)):
+                self._rotate()
+            self._file.write(line)
+            self._shard_records += 1
+            self._shard_bytes += len(line)
+        self._buffer = []
+        if self.durability != 'none':
+            self._file.flush()
+            if self.durability == 'fsync':
+                os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+        metrics.run.add_stage('write', time.perf_counter() - start)
+        callbacks, self._callbacks = self._callbacks, []
+        return callbacks
+
+    def flush(self):
+        with self._lock:
+            callbacks = self._flush()
+            self._file.flush()
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,98 @@
+import logging
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_TOKEN_PATTERN = re.compile(r'\w+')
+
+
+# Pick the LSH band/row split whose S-curve threshold (1/b)^(1/r) is closest to the similarity threshold
+def lsh_params(threshold, num_perm):
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+# MinHash/LSH near-duplicate filter for chunks. Chunks are checked in order: the first occurrence is kept and
+# every later chunk whose estimated Jaccard similarity of word shingles reaches `threshold` is dropped.
+class NearDuplicateFilter:
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 61, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 61, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self._sources = []
+        self.kept = Counter()
+        self.dropped = Counter()
+        self.duplicate_of = Counter()
+
+    def signature(self, text):
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        size = self.shingle_size
+        shingles = {' '.join(tokens[i:i + size]) for i in range(max(1, len(tokens) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    # Return the index of a kept chunk whose signature agrees with `signature` on enough positions, or None
+    def _find_duplicate(self, signature, keys):
+        candidates = set()
+        for bucket, key in zip(self._buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        for candidate in sorted(candidates):
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                return candidate
+        return None
+
+    # Register a chunk as kept without checking it, e.g. chunks already generated in an earlier run
+    def add(self, chunk):
+        signature = self.signature(chunk.page_content)
+        self._insert(signature, self._band_keys(signature), chunk.metadata['source'])
+
+    def _insert(self, signature, keys, source):
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        self._sources.append(source)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(index)
+
+    def is_duplicate(self, chunk):
+        source = chunk.metadata['source']
+        signature = self.signature(chunk.page_content)
+        keys = self._band_keys(signature)
+        match = self._find_duplicate(signature, keys)
+        if match is not None:
+            self.dropped[source] += 1
+            self.duplicate_of[(source, self._sources[match])] += 1
+            return True
+        self._insert(signature, keys, source)
+        self.kept[source] += 1
+        return False
+
+    # Function to lazily drop near-duplicate chunks; works on lists and streams alike
+    def filter(self, chunks):
+        for chunk in chunks:
+            if not self.is_duplicate(chunk):
+                yield chunk
+
+    def report(self):
+        total_dropped = sum(self.dropped.values())
+        total = total_dropped + sum(self.kept.values())
+        logging.info(f"Near-duplicate filter (threshold {self.threshold}, {self.bands}x{self.rows} LSH): "
+                     f"dropped {total_dropped} of {total} chunks")
+        for source in sorted(set(self.kept) | set(self.dropped)):
+            if self.dropped[source]:
+                logging.info(f"  {source or '<unknown>'}: dropped {self.dropped[source]}, kept {self.kept[source]}")
+        for (source, kept_source), count in self.duplicate_of.most_common():
+            logging.info(f"  {count} chunks from {source or '<unknown>'} duplicated {kept_source or '<unknown>'}")
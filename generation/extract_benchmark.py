@@ -0,0 +1,167 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter
+
+import lxml.html
+
+import fast_extract
+import load_data
+
+_FENCED_BLOCK_PATTERN = re.compile(r'^\s{0,3}```[^\n]*\n(.*?)^\s{0,3}```', re.MULTILINE | re.DOTALL)
+
+_TERMS = ['timing', 'placement', 'routing', 'netlist', 'liberty', 'floorplan', 'clock tree', 'power grid',
+          'congestion', 'slack', 'macro', 'standard cell', 'synthesis', 'parasitics', 'µs slack', 'skew – hold']
+_COMMANDS = ['set_clock_uncertainty -setup {v} [get_clocks clk]', 'read_liberty -corner ss lib_{v}.lib',
+             'global_placement -density 0.{v} \\\n    -pad_left 2', 'detailed_route -output_drc route_{v}.rpt',
+             'report_checks -path_delay max -group_count {v}', 'set_wire_rc -signal -layer metal{v}',
+             'set_input_delay 0.{v} [all_inputs] ;# ±{v} µs – setup']
+
+
+def _paragraph(rng):
+    return ' '.join(f"The {rng.choice(_TERMS)} step updates the {rng.choice(_TERMS)} of the design."
+                    for _ in range(rng.randint(2, 6)))
+
+
+def _code(rng):
+    return '\n'.join(command.format(v=rng.randint(1, 9)) for command in rng.sample(_COMMANDS, 3))
+
+
+# Function to write Sphinx-style HTML pages (sidebar, related bar, permalinks, highlighted <pre>) and Markdown
+# documents that stand in for the OpenROAD/yosys doc trees; every other page is UTF-8 without a declared charset
+def write_samples(directory, pages, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for page in range(pages):
+        sections_html, sections_md = [], []
+        for section in range(rng.randint(3, 8)):
+            title = f"{rng.choice(_TERMS).title()} {section}"
+            paragraphs = [_paragraph(rng) for _ in range(rng.randint(1, 4))]
+            code = _code(rng)
+            highlighted = ''.join(f'<span class="nv">{token}</span> ' if index == 0 else f'{token} '
+                                  for index, token in enumerate(code.split(' '))).rstrip()
+            sections_html.append(
+                f'<section id="s{section}"><h2>{title}<a class="headerlink" href="#s{section}">¶</a></h2>'
+                + ''.join(f'<p>{text}</p>' for text in paragraphs)
+                + f'<div class="highlight-tcl notranslate"><div class="highlight"><pre><span></span>{highlighted}\n'
+                  f'</pre></div></div></section>')
+            sections_md.append(f"## {title}\n\n" + '\n\n'.join(paragraphs) + f"\n\n```tcl\n{code}\n```\n")
+        nav = ''.join(f'<li class="toctree-l1"><a href="p{index}.html">{rng.choice(_TERMS)}</a></li>'
+                      for index in range(30))
+        charset = '<meta charset="utf-8">' if page % 2 == 0 else ''
+        with open(os.path.join(directory, f'page_{page:05d}.html'), 'w', encoding='utf-8') as file:
+            file.write(
+                f'<!DOCTYPE html><html><head>{charset}<title>OpenROAD</title>'
+                '<script>var DOCUMENTATION_OPTIONS = {};</script><style>body {margin: 0}</style></head><body>'
+                f'<div class="related" role="navigation"><ul><li><a href="index.html">index</a></li></ul></div>'
+                '<div class="document"><div class="documentwrapper"><div class="bodywrapper">'
+                f'<div class="body" role="main"><h1>Page {page}<a class="headerlink" href="#">¶</a></h1>'
+                + ''.join(sections_html)
+                + '</div></div></div>'
+                f'<div class="sphinxsidebar" role="navigation"><h3>Navigation</h3><ul>{nav}</ul>'
+                '<div id="searchbox" role="search"><form><input type="text" name="q"/></form></div></div></div>'
+                '<div class="footer">&copy; The OpenROAD Project</div></body></html>')
+        with open(os.path.join(directory, f'doc_{page:05d}.md'), 'w', encoding='utf-8') as file:
+            file.write(f"# Page {page}\n\n" + '\n'.join(sections_md))
+
+
+def code_blocks(file_path):
+    if file_path.endswith('.html'):
+        with open(file_path, 'rb') as file:
+            document = lxml.html.document_fromstring(fast_extract.decode_html(file.read()))
+            return [pre.text_content() for pre in document.xpath('//pre')]
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return _FENCED_BLOCK_PATTERN.findall(file.read())
+
+
+# Function to return the fraction of code blocks whose lines all survive extraction as lines of their own
+def code_intact(text, blocks):
+    if not blocks:
+        return None
+    lines = {line.strip() for line in text.splitlines()}
+    return sum(all(line.strip() in lines for line in block.splitlines() if line.strip())
+               for block in blocks) / len(blocks)
+
+
+# Function to compare the words of two extractions: how much of the reference the candidate keeps (recall), and
+# how much of the candidate is in the reference (precision)
+def word_overlap(reference, candidate):
+    reference_words, candidate_words = Counter(reference.split()), Counter(candidate.split())
+    common = sum((reference_words & candidate_words).values())
+    return (common / max(1, sum(reference_words.values())), common / max(1, sum(candidate_words.values())))
+
+
+def extract(loader, file_path):
+    return '\n'.join(document.page_content for pages in loader(file_path) for document in pages)
+
+
+# Function to time both extractors over the files of one format, in this process, and score the fast output
+# against the current loader
+def compare(extension, file_paths):
+    megabytes = sum(os.path.getsize(file_path) for file_path in file_paths) / (1024 * 1024)
+    outputs, result = {}, {"format": extension, "files": len(file_paths), "mb": megabytes}
+    for name, loader in (('current', load_data.LOADERS[extension]), ('fast', load_data.FAST_LOADERS[extension])):
+        start = time.perf_counter()
+        try:
+            outputs[name] = [extract(loader, file_path) for file_path in file_paths]
+        except Exception as e:
+            logging.warning(f"{name} {extension} extractor failed: {type(e).__name__}: {e}")
+            result[name] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        seconds = time.perf_counter() - start
+        intact = [code_intact(text, code_blocks(file_path)) for text, file_path in zip(outputs[name], file_paths)]
+        intact = [value for value in intact if value is not None]
+        result[name] = {"seconds": seconds, "files_per_s": len(file_paths) / seconds, "mb_per_s": megabytes / seconds,
+                        "code_blocks_intact": sum(intact) / len(intact) if intact else None}
+    if len(outputs) == 2:
+        overlaps = [word_overlap(reference, candidate)
+                    for reference, candidate in zip(outputs['current'], outputs['fast'])]
+        result["speedup"] = result['current']["seconds"] / result['fast']["seconds"]
+        result["word_recall"] = sum(recall for recall, _ in overlaps) / len(overlaps)
+        result["word_precision"] = sum(precision for _, precision in overlaps) / len(overlaps)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the fast HTML/Markdown extractor with the current loaders')
+    parser.add_argument('paths', nargs='*', help='Folders of .html/.md files (default: generated Sphinx-style pages)')
+    parser.add_argument('--pages', type=int, default=200, help='Pages of each format to generate without paths')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        folders = args.paths
+        if not folders:
+            write_samples(work_dir, args.pages, args.seed)
+            folders = [work_dir]
+        report = []
+        for extension in ('html', 'md'):
+            file_paths = [file_path for folder in folders for file_path in load_data.find_files(folder, extension)]
+            if not file_paths:
+                continue
+            if extension == 'html':
+                load_data.ensure_nltk()
+            result = compare(extension, file_paths)
+            for name in ('current', 'fast'):
+                stats = result[name]
+                if "error" in stats:
+                    continue
+                intact = stats["code_blocks_intact"]
+                logging.info(f"{extension} {name}: {stats['files_per_s']:.1f} files/s, {stats['mb_per_s']:.2f} MB/s, "
+                             f"code blocks intact {'n/a' if intact is None else f'{intact:.0%}'}")
+            if "speedup" in result:
+                logging.info(f"{extension}: fast is {result['speedup']:.1f}x faster; word recall "
+                             f"{result['word_recall']:.1%}, precision {result['word_precision']:.1%} "
+                             f"against the current loader")
+            report.append(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
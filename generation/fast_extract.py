@@ -0,0 +1,198 @@
+import html
+import re
+
+import lxml.html
+
+# Elements whose text never belongs in the corpus
+DROP_TAGS = ('script', 'style', 'noscript', 'template', 'nav', 'aside', 'form', 'button', 'svg', 'iframe')
+# Navigation, sidebars and permalinks of the doc generators behind the EDA tool docs: Sphinx (basic/alabaster,
+# Read the Docs, pydata, furo) and MkDocs Material
+BOILERPLATE_CLASSES = (
+    'sphinxsidebar', 'related', 'footer', 'headerlink', 'searchbox', 'toc-backref',
+    'wy-nav-side', 'wy-nav-top', 'wy-breadcrumbs', 'rst-footer-buttons', 'rst-versions',
+    'bd-header', 'bd-sidebar-primary', 'bd-sidebar-secondary', 'bd-footer', 'prev-next-area', 'header-article',
+    'sidebar-drawer', 'toc-drawer', 'mobile-header', 'skip-to-content', 'related-pages',
+    'md-header', 'md-sidebar', 'md-footer', 'md-source-file',
+)
+# Main content containers, most specific first; the whole body is used when none is present
+CONTENT_XPATHS = (
+    "//*[@role='main']",
+    '//main',
+    '//article',
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' body ')]",
+    '//body',
+)
+BLOCK_TAGS = {
+    'address', 'article', 'blockquote', 'br', 'caption', 'dd', 'details', 'div', 'dl', 'dt', 'figcaption',
+    'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'ol', 'p', 'section',
+    'summary', 'table', 'tbody', 'thead', 'tfoot', 'tr', 'ul',
+}
+CELL_TAGS = {'td', 'th'}
+
+_BOILERPLATE_XPATH = ' | '.join(
+    [f'.//{tag}' for tag in DROP_TAGS]
+    + [f".//*[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]" for name in BOILERPLATE_CLASSES]
+    + [".//*[@role='navigation' or @role='search' or @role='contentinfo']"]
+)
+# A charset declared by the page itself: <meta charset>, <meta http-equiv="Content-Type"> or an XML declaration
+_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=|<\?xml[^>]+encoding\s*=', re.IGNORECASE)
+# Bytes searched for a charset declaration, as browsers do
+_CHARSET_SCAN_BYTES = 1024
+# Marks a block boundary between text pieces
+_BREAK = object()
+
+
+# A preformatted block whose whitespace is kept as is
+class _Pre(str):
+    pass
+
+
+def _collect(element, pieces):
+    tag = element.tag if isinstance(element.tag, str) else None
+    if tag == 'pre':
+        pieces.extend((_BREAK, _Pre(element.text_content()), _BREAK))
+    elif tag is not None:
+        block = tag in BLOCK_TAGS
+        if block:
+            pieces.append(_BREAK)
+        elif tag in CELL_TAGS:
+            pieces.append(' ')
+        if element.text:
+            pieces.append(element.text)
+        for child in element:
+            _collect(child, pieces)
+        if block:
+            pieces.append(_BREAK)
+    if element.tail:
+        pieces.append(element.tail)
+
+
+# Function to join text pieces into lines: whitespace of normal text is collapsed per block, <pre> blocks are
+# emitted verbatim (only trailing spaces and surrounding blank lines removed)
+def _render(pieces):
+    lines, inline = [], []
+
+    def flush():
+        text = ' '.join(''.join(inline).split())
+        if text:
+            lines.append(text)
+        inline.clear()
+
+    for piece in pieces:
+        if piece is _BREAK:
+            flush()
+        elif isinstance(piece, _Pre):
+            flush()
+            block = '\n'.join(line.rstrip() for line in piece.split('\n')).strip('\n')
+            if block:
+                lines.append(block)
+        else:
+            inline.append(piece)
+    flush()
+    return '\n'.join(lines)
+
+
+# Function to decode a page that does not declare its charset. lxml would read it as Latin-1, turning UTF-8 text
+# such as "–" or "µ" into mojibake; pages that are not valid UTF-8 are left to that fallback.
+def decode_html(content):
+    if isinstance(content, str) or _CHARSET_PATTERN.search(content[:_CHARSET_SCAN_BYTES]):
+        return content
+    try:
+        return content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return content
+
+
+# Function to extract the readable text of an HTML page (bytes or str): the main content container is located,
+# scripts, navigation, sidebars and permalink anchors are removed, and code blocks keep their line structure
+def html_to_text(content):
+    if not content or not content.strip():
+        return ''
+    document = lxml.html.document_fromstring(decode_html(content))
+    root = next((found[0] for xpath in CONTENT_XPATHS if (found := document.xpath(xpath))), document)
+    for element in root.xpath(_BOILERPLATE_XPATH):
+        # An element may already be gone with a removed ancestor
+        if element.getparent() is not None:
+            element.drop_tree()
+    pieces = []
+    _collect(root, pieces)
+    return _render(pieces)
+
+
+_FENCE_PATTERN = re.compile(r'^\s{0,3}(`{3,}|~{3,})')
+_HEADING_PATTERN = re.compile(r'^\s{0,3}#{1,6}(?:\s+|$)(.*?)(?:\s+#+)?\s*$')
+_SETEXT_PATTERN = re.compile(r'^\s{0,3}(=+|-+)\s*$')
+_RULE_PATTERN = re.compile(r'^\s{0,3}([-*_])(?:\s*\1){2,}\s*$')
+_QUOTE_PATTERN = re.compile(r'^\s{0,3}>\s?')
+_LIST_PATTERN = re.compile(r'^\s*(?:[-*+]|\d+[.)])\s+')
+_LINK_DEFINITION_PATTERN = re.compile(r'^\s{0,3}\[[^\]]+\]:\s*\S')
+_CODE_SPAN_PATTERN = re.compile(r'(`+)(.+?)\1')
+_IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+_LINK_PATTERN = re.compile(r'\[([^\]]+)\](?:\([^)]*\)|\[[^\]]*\])')
+_AUTOLINK_PATTERN = re.compile(r'<((?:https?|ftp|mailto):[^>\s]+)>')
+_TAG_PATTERN = re.compile(r'</?[A-Za-z][^>]*>|<!--.*?-->')
+_STRONG_PATTERN = re.compile(r'(\*\*|(?<!\w)__)(?=\S)(.+?)(?<=\S)\1')
+# Underscores inside identifiers such as set_clock_uncertainty are not emphasis
+_EMPHASIS_PATTERN = re.compile(r'(\*|(?<!\w)_)(?=\S)(.+?)(?<=\S)\1(?!\w)')
+_ESCAPE_PATTERN = re.compile(r'\\([\\`*_{}\[\]()#+\-.!|>~])')
+
+
+def _inline(text):
+    text = _IMAGE_PATTERN.sub(r'\1', text)
+    text = _LINK_PATTERN.sub(r'\1', text)
+    text = _AUTOLINK_PATTERN.sub(r'\1', text)
+    text = _TAG_PATTERN.sub('', text)
+    text = _STRONG_PATTERN.sub(r'\2', text)
+    text = _EMPHASIS_PATTERN.sub(r'\2', text)
+    return html.unescape(_ESCAPE_PATTERN.sub(r'\1', text))
+
+
+# Function to strip inline markup from one line; code spans are kept literally
+def _strip_line(line):
+    parts = _CODE_SPAN_PATTERN.split(line)
+    # split() yields [text, fence, code, text, fence, code, ...]
+    return ''.join(_inline(part) if index % 3 == 0 else part.strip() if index % 3 == 2 else ''
+                   for index, part in enumerate(parts))
+
+
+# Function to extract the text of a Markdown document without rendering it to HTML first: fenced and indented
+# code blocks are kept verbatim, headings, quotes and list markers lose their syntax and inline markup is removed
+def markdown_to_text(content):
+    lines = []
+    fence = None
+    previous_blank, indented = True, False
+    for line in content.splitlines():
+        if fence:
+            if line.strip().startswith(fence):
+                fence = None
+            else:
+                lines.append(line.rstrip())
+            continue
+        match = _FENCE_PATTERN.match(line)
+        if match:
+            fence = match.group(1)[0] * len(match.group(1))
+            continue
+        if not line.strip():
+            if lines and lines[-1]:
+                lines.append('')
+            previous_blank = True
+            continue
+        # Indented code: lines indented by four spaces (or a tab) that start after a blank line
+        if line.startswith(('    ', '\t')) and (previous_blank or indented):
+            lines.append(line[4 if line.startswith('    ') else 1:].rstrip())
+            previous_blank, indented = False, True
+            continue
+        previous_blank, indented = False, False
+        if _LINK_DEFINITION_PATTERN.match(line) or _RULE_PATTERN.match(line) or _SETEXT_PATTERN.match(line):
+            continue
+        heading = _HEADING_PATTERN.match(line)
+        if heading:
+            line = heading.group(1)
+        else:
+            line = _LIST_PATTERN.sub('', _QUOTE_PATTERN.sub('', line))
+        text = _strip_line(line).strip()
+        if text:
+            lines.append(text)
+    while lines and not lines[-1]:
+        lines.pop()
+    return '\n'.join(lines)
@@ -0,0 +1,230 @@
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+import openai
+
+import load_data
+import metrics
+
+# Seconds between checks for a free request slot while the AIMD limit is below the number of workers
+_SLOT_POLL = 0.05
+# HTTP statuses worth retrying besides 429: timeouts, conflicts and server errors
+_RETRYABLE_STATUSES = {408, 409, 500, 502, 503, 504}
+# HTTP statuses that every request of the run would get (bad key, no permission, unknown model)
+_FATAL_STATUSES = {401, 403, 404}
+
+
+# Raised for errors that no retry can fix and that every other request would hit too; the run should stop
+class FatalAPIError(Exception):
+    pass
+
+
+# Function to classify an API exception as 'rate_limit', 'retryable', 'rejected' or 'fatal'. 'rejected' is a
+# request the API refused for its own content (context too long, content filter, 400/413/422): retrying it
+# does not help, but only the chunk it came from fails.
+def classify(error):
+    if isinstance(error, openai.RateLimitError):
+        return 'rate_limit'
+    # Connection failures and timeouts never reached the model
+    if isinstance(error, openai.APIConnectionError):
+        return 'retryable'
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code in _RETRYABLE_STATUSES or error.status_code >= 500:
+            return 'retryable'
+        return 'fatal' if error.status_code in _FATAL_STATUSES else 'rejected'
+    return 'fatal'
+
+
+# Function to read the delay the server asked for from `retry-after-ms` / `retry-after` (seconds or an HTTP date)
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Token bucket refilled continuously at `per_minute`, holding at most one minute's worth. A request larger than
+# what is left may take the balance below zero, so one large prompt is delayed instead of blocked forever.
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` may be taken (0 when it can be taken now)
+    def wait_time(self, amount, now):
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+
+# Shared request governor: requests/min and tokens/min token buckets, an AIMD limit on requests in flight that is
+# halved on a 429 and grows back by one slot per window of successes, a global pause while the server's
+# Retry-After runs, and jittered exponential backoff with at most `max_attempts` tries per request.
+# Thread-safe; `call` is used from threads and `call_async` from the async engine.
+class Governor:
+    def __init__(self, rpm=None, tpm=None, max_concurrency=None, min_concurrency=1, max_attempts=6,
+                 base_delay=1.0, max_delay=60.0):
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Without a ceiling the limit starts unbounded, so only the caller's worker count applies until a 429
+        self.limit = float(max_concurrency or 'inf')
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    # Function to admit a request if a slot and the bucket budget are free; returns 0 when admitted, otherwise the
+    # seconds to wait before asking again
+    def _admit(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.in_flight + 1 > max(self.min_concurrency, self.limit):
+                return _SLOT_POLL
+            wait = max(self.rpm.wait_time(1, now) if self.rpm else 0.0,
+                       self.tpm.wait_time(tokens, now) if self.tpm else 0.0)
+            if wait > 0:
+                return wait
+            if self.rpm:
+                self.rpm.take(1)
+            if self.tpm:
+                self.tpm.take(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _succeeded(self, tokens, usage):
+        with self._lock:
+            self.in_flight -= 1
+            if self.limit < (self.max_concurrency or float('inf')):
+                self.limit = min(self.limit + 1 / self.limit, self.max_concurrency or float('inf'))
+            # Charge the bucket with what the request really used instead of the prompt estimate
+            if self.tpm and usage is not None:
+                self.tpm.take((getattr(usage, 'total_tokens', 0) or 0) - tokens)
+
+    # Function to record a failed attempt; returns the seconds to back off before the next one
+    def _failed(self, error, kind, attempt):
+        delay = retry_after(error)
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if kind == 'rate_limit':
+                # One decrease per burst of 429s: requests already in flight when the limit dropped also fail
+                if now - self._last_decrease >= max(1.0, delay or 0.0):
+                    self.limit = max(self.min_concurrency, min(self.limit, self.in_flight + 1) / 2)
+                    self._last_decrease = now
+                    logging.warning(f"Rate limited; concurrency limit lowered to {self.limit:.1f}")
+                if delay:
+                    self._paused_until = max(self._paused_until, now + delay)
+        if delay is None:
+            cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = cap / 2 + random.uniform(0, cap / 2)
+        else:
+            # Jitter so the paused requests do not all resume at the same instant
+            delay += random.uniform(0, self.base_delay)
+        return delay
+
+    def _handle(self, error, attempt):
+        kind = classify(error)
+        metrics.run.count('rate_limited' if kind == 'rate_limit' else 'request_errors')
+        if kind == 'fatal':
+            self._release()
+            raise FatalAPIError(f"{type(error).__name__}: {error}") from error
+        if kind == 'rejected':
+            self._release()
+            raise error
+        delay = self._failed(error, kind, attempt)
+        if attempt + 1 >= self.max_attempts:
+            raise error
+        logging.warning(f"Attempt {attempt + 1}/{self.max_attempts} failed ({type(error).__name__}), "
+                        f"retrying in {delay:.1f}s")
+        return delay
+
+    def _done(self, tokens, start, result, model):
+        usage = getattr(result, 'usage', None)
+        self._succeeded(tokens, usage)
+        metrics.run.observe_request(time.perf_counter() - start, usage, model)
+        return result
+
+    # Function to run `request()` under the governor; `prompt` is the text whose tokens are charged to the TPM
+    # bucket and `model` is what the request is billed as
+    def call(self, request, prompt='', model=None):
+        tokens = load_data.count_tokens(prompt) if self.tpm else 0
+        for attempt in range(self.max_attempts):
+            waited = time.perf_counter()
+            while (wait := self._admit(tokens)) > 0:
+                time.sleep(wait)
+            start = time.perf_counter()
+            metrics.run.add_stage('throttle', start - waited)
+            try:
+                result = request()
+            except Exception as e:
+                time.sleep(self._handle(e, attempt))
+                continue
+            except BaseException:
+                self._release()
+                raise
+            return self._done(tokens, start, result, model)
+
+    async def call_async(self, request, prompt='', model=None):
+        tokens = load_data.count_tokens(prompt) if self.tpm else 0
+        for attempt in range(self.max_attempts):
+            waited = time.perf_counter()
+            while (wait := self._admit(tokens)) > 0:
+                await asyncio.sleep(wait)
+            start = time.perf_counter()
+            metrics.run.add_stage('throttle', start - waited)
+            try:
+                result = await request()
+            except Exception as e:
+                await asyncio.sleep(self._handle(e, attempt))
+                continue
+            except BaseException:
+                # Cancelled: give the slot back
+                self._release()
+                raise
+            return self._done(tokens, start, result, model)
+
+
+# Governor configured from OPENAI_RPM, OPENAI_TPM and OPENAI_MAX_ATTEMPTS; unset limits are not enforced
+def from_env():
+    return Governor(
+        rpm=int(os.environ.get('OPENAI_RPM', 0)) or None,
+        tpm=int(os.environ.get('OPENAI_TPM', 0)) or None,
+        max_attempts=int(os.environ.get('OPENAI_MAX_ATTEMPTS', 6)),
+    )
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+from langchain.docstore.document import Document
+
+import load_data
+
+
+# Function to hash a file in blocks so large PDFs are never read into memory at once
+def file_hash(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Persistent ingestion index: for every source file it stores path, size, mtime, content hash and the
+# IDs of the chunks it produced, and it keeps the chunk text itself. A refresh only parses new or modified
+# files; everything else is served from the index. Chunks stay "new" until mark_generated is called, so
+# an interrupted generation run hands the same chunks over again next time.
+class IngestIndex:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, chunk_ids TEXT);"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "chunk_id TEXT PRIMARY KEY, source TEXT, content TEXT, generated INTEGER DEFAULT 0);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        self._check_split_config()
+
+    # Cached chunks are only valid for the extractor and splitter settings that produced them
+    def _check_split_config(self):
+        config = json.dumps(dict(load_data.SPLIT_CONFIG, **load_data.LOAD_CONFIG), sort_keys=True)
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'split_config'").fetchone()
+        if row and row[0] != config:
+            logging.info("Extractor or splitter settings changed, re-ingesting every file")
+            self._conn.execute("DELETE FROM files")
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('split_config', ?)", (config,))
+        self._conn.commit()
+
+    # Function to bring the index up to date with `folder_path`; returns (all chunks, not yet generated chunks)
+    def refresh(self, folder_path, workers=None):
+        prefix = os.path.join(os.path.abspath(folder_path), '')
+        known = {row[0]: row[1:] for row in self._conn.execute(
+            "SELECT path, size, mtime_ns, sha256, chunk_ids FROM files") if row[0].startswith(prefix)}
+        file_paths = [os.path.abspath(file_path) for file_path in load_data.list_files(folder_path)]
+
+        changed, hashes = [], {}
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            row = known.get(file_path)
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                continue
+            hashes[file_path] = file_hash(file_path)
+            if row and row[2] == hashes[file_path]:
+                # Touched but not modified: keep the chunks, remember the new mtime
+                self._conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                                   (stat.st_size, stat.st_mtime_ns, file_path))
+                continue
+            changed.append(file_path)
+
+        results = load_data.load_file_results(changed, workers, desc='Loading changed files')
+        failed = 0
+        for file_path, (docs, error) in zip(changed, results):
+            if error is not None:
+                failed += 1
+                logging.warning(f"Failed to load {file_path}: {error}")
+                continue
+            chunks = load_data.split_docs(docs)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks (chunk_id, source, content) VALUES (?, ?, ?)",
+                [(chunk.metadata['chunk_id'], chunk.metadata['source'], chunk.page_content) for chunk in chunks])
+            stat = os.stat(file_path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime_ns, hashes[file_path],
+                 json.dumps([chunk.metadata['chunk_id'] for chunk in chunks])))
+
+        removed = set(known) - set(file_paths)
+        self._conn.executemany("DELETE FROM files WHERE path = ?", [(file_path,) for file_path in removed])
+        # Chunks no longer produced by any file are dropped
+        referenced = set()
+        for (chunk_ids,) in self._conn.execute("SELECT chunk_ids FROM files"):
+            referenced.update(json.loads(chunk_ids))
+        stale = [(chunk_id,) for (chunk_id,) in self._conn.execute("SELECT chunk_id FROM chunks")
+                 if chunk_id not in referenced]
+        self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", stale)
+        self._conn.commit()
+
+        chunks, new_chunks = self._load_chunks(file_paths)
+        logging.info(f"Ingestion index: {len(file_paths)} files, {len(changed)} new or modified "
+                     f"({failed} failed), {len(removed)} removed; {len(chunks)} chunks, {len(new_chunks)} new")
+        return chunks, new_chunks
+
+    def _load_chunks(self, file_paths):
+        chunk_ids = []
+        for start in range(0, len(file_paths), 500):
+            batch = file_paths[start:start + 500]
+            rows = dict(self._conn.execute(
+                f"SELECT path, chunk_ids FROM files WHERE path IN ({','.join('?' * len(batch))})", batch))
+            for file_path in batch:
+                chunk_ids.extend(json.loads(rows[file_path]) if file_path in rows else [])
+
+        rows = {}
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            for chunk_id, source, content, generated in self._conn.execute(
+                    f"SELECT chunk_id, source, content, generated FROM chunks "
+                    f"WHERE chunk_id IN ({','.join('?' * len(batch))})", batch):
+                rows[chunk_id] = (source, content, generated)
+
+        chunks, new_chunks, seen = [], [], set()
+        for chunk_id in chunk_ids:
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            source, content, generated = rows[chunk_id]
+            chunk = Document(page_content=content, metadata={'source': source, 'chunk_id': chunk_id})
+            chunks.append(chunk)
+            if not generated:
+                new_chunks.append(chunk)
+        return chunks, new_chunks
+
+    def mark_generated(self, chunk_id):
+        self._conn.execute("UPDATE chunks SET generated = 1 WHERE chunk_id = ?", (chunk_id,))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
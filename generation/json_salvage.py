@@ -0,0 +1,127 @@
+import json
+import logging
+import re
+from collections import Counter
+
+import metrics
+
+# Expected shape of each prompt's output: required string fields, and whether the prompt returns a list of
+# items or a single object
+SCHEMAS = {
+    # qa prompt in openai_api
+    "qa": {"fields": ("type", "query", "answer"), "many": True},
+    # script prompt in openai_api
+    "script": {"fields": ("script_name", "definition_description", "script_paradigm"), "many": True},
+    # script_judge prompt in openai_api; `script_found` is checked separately
+    "script_judge": {"fields": (), "many": False},
+    # script_fused prompt in openai_api: script items, or a lone `{"script_found": false}` when there are none
+    "script_fused": {"fields": ("script_name", "definition_description", "script_paradigm"), "many": True},
+    # knowledge_advice_prompt in trans_format/process_data.py
+    "knowledge_advice": {"fields": ("knowledge_advice_question", "knowledge_advice_answer", "topic"), "many": False},
+    # script_prompt in trans_format/process_data.py
+    "code": {"fields": ("definition_description", "code_paradigm"), "many": False},
+}
+
+# A ```json block, possibly cut off before its closing fence
+_FENCE_PATTERN = re.compile(r'```json\s*(.*?)\s*(```|$)', re.DOTALL)
+_OPEN_PATTERN = re.compile(r'[\[{]')
+_TRAILING_COMMA_PATTERN = re.compile(r',(\s*[}\]])')
+
+# Parse outcomes of the current run:
+#   clean      - the fenced block was valid JSON and every item matched the schema
+#   salvaged   - the response needed repairs or lost items, but at least one item was recovered
+#   unparsable - nothing usable; the caller re-requests the completion
+#   dropped    - individual items discarded for not matching the schema
+stats = Counter()
+
+
+# Function to remove commas before a closing bracket, leaving string contents untouched
+def _strip_trailing_commas(text):
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', text)
+    return ''.join(part if index % 2 else _TRAILING_COMMA_PATTERN.sub(r'\1', part)
+                   for index, part in enumerate(parts))
+
+
+# Function to collect every complete JSON value in `text`: a value that decodes is taken whole, and an array or
+# object that does not (truncated, or broken by a bad element) is entered so its complete elements are still found
+def _scan_values(text):
+    decoder = json.JSONDecoder()
+    values = []
+    position = 0
+    while True:
+        match = _OPEN_PATTERN.search(text, position)
+        if not match:
+            return values
+        try:
+            value, end = decoder.raw_decode(text, match.start())
+        except json.JSONDecodeError:
+            position = match.start() + 1
+            continue
+        values.append(value)
+        position = end
+
+
+def _is_valid(item, schema):
+    if not isinstance(item, dict):
+        return False
+    if schema == "script_judge":
+        return str(item.get("script_found")).lower() in ('true', 'false')
+    # `"script_found": true` without any scripts is no answer, so it is re-requested
+    if schema == "script_fused" and "script_found" in item and "script_name" not in item:
+        return str(item["script_found"]).lower() == 'false'
+    return all(isinstance(item.get(field), str) and item[field].strip() for field in SCHEMAS[schema]["fields"])
+
+
+def _normalize(item, schema):
+    if schema in ("script_judge", "script_fused") and not isinstance(item.get("script_found", False), bool):
+        item["script_found"] = str(item["script_found"]).lower() == 'true'
+    return item
+
+
+# Function to parse a completion into the items `schema` expects: a list of items for list prompts, a single
+# object otherwise. Unfenced JSON, trailing commas, a lone object where a list was asked for and a truncated last
+# element are all recovered from; items missing required fields are dropped. Raises ValueError when nothing
+# usable is left, so the caller can request the completion again.
+def parse(content, schema):
+    with metrics.run.stage('parse'):
+        return _parse(content, schema)
+
+
+def _parse(content, schema):
+    spec = SCHEMAS[schema]
+    fence = _FENCE_PATTERN.search(content)
+    # Without a ```json block the whole response is searched, prose and other code blocks included
+    text = fence.group(1) if fence else content
+    clean = bool(fence and fence.group(2))
+    try:
+        values = [json.loads(text)]
+    except json.JSONDecodeError:
+        clean = False
+        repaired = _strip_trailing_commas(text)
+        try:
+            values = [json.loads(repaired)]
+        except json.JSONDecodeError:
+            values = _scan_values(repaired)
+
+    candidates = []
+    for value in values:
+        candidates.extend(value if isinstance(value, list) else [value])
+    items = [_normalize(item, schema) for item in candidates if _is_valid(item, schema)]
+    dropped = len(candidates) - len(items)
+    stats["dropped"] += dropped
+    if not items:
+        stats["unparsable"] += 1
+        metrics.run.count('parse_failures')
+        raise ValueError(f"No valid {schema} JSON found in the content")
+    outcome = "clean" if clean and not dropped and len(values) == 1 else "salvaged"
+    stats[outcome] += 1
+    if outcome == "salvaged":
+        metrics.run.count('salvaged_responses')
+    return items if spec["many"] else items[0]
+
+
+def log_stats():
+    total = stats["clean"] + stats["salvaged"] + stats["unparsable"]
+    if total:
+        logging.info(f"JSON parsing: {stats['clean']} clean, {stats['salvaged']} salvaged (API calls avoided), "
+                     f"{stats['unparsable']} unparsable (re-requested); {stats['dropped']} items failed the schema")
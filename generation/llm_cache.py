@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Cache modes:
+#   readwrite - serve hits from the cache and store every new completion (default)
+#   replay    - read-only, a miss raises CacheMiss instead of calling the API
+#   off       - bypass the cache entirely
+CACHE_MODES = ('readwrite', 'replay', 'off')
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class LLMCache:
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024, mode='readwrite'):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._size = 0
+
+    # The database is opened lazily so importing the API module never touches the disk
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return self._conn
+
+    @staticmethod
+    def key(model, sys_prompt, user_prompt):
+        payload = json.dumps([model, sys_prompt, user_prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # Return the cached response for `key`, or None on a miss (CacheMiss in replay mode)
+    def get(self, key):
+        if self.mode == 'off':
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        if row is None and self.mode == 'replay':
+            raise CacheMiss(f"No cached response for {key} in replay mode")
+        return row[0] if row else None
+
+    def put(self, key, model, response):
+        if self.mode != 'readwrite':
+            return
+        size = len(response.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, model, response, size, now, now)
+            )
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    # Drop least recently used entries until the cache is back under 90% of its budget
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+        stale = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            stale.append((key,))
+            self._size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+        self.evictions += len(stale)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self._size,
+        }
+
+    def log_stats(self):
+        if self.mode == 'off':
+            return
+        stats = self.stats()
+        logging.info(
+            f"LLM cache ({stats['mode']}): {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.1%} hit rate), {stats['evictions']} evictions, "
+            f"{stats['size_bytes'] / 1024 / 1024:.1f} MB on disk"
+        )
+
+
+# Build the cache from OPENAI_CACHE_* environment variables
+def from_env(default_path='./.llm_cache.sqlite'):
+    return LLMCache(
+        path=os.environ.get("OPENAI_CACHE_PATH", default_path),
+        max_bytes=int(float(os.environ.get("OPENAI_CACHE_MAX_MB", 1024)) * 1024 * 1024),
+        mode=os.environ.get("OPENAI_CACHE_MODE", 'readwrite'),
+    )
@@ -1,5 +1,14 @@
+import hashlib
+import json
+import logging
 import os
 import glob
+import random
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
 from langchain_community.document_loaders import UnstructuredHTMLLoader, PyMuPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import nltk
@@ -8,30 +17,48 @@ from tqdm import tqdm
 from bs4 import BeautifulSoup
 from langchain.docstore.document import Document
 
+import fast_extract
+import metrics
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 doc_list = ['amaranth', 'Icarus_verilog', 'klayout', 'qflow', 'OpenROAD', 'OpenSTA', 'OpenROAD_flow_script',
             'verilator', 'yosys_hq', 'iverilog']
 
+# Splitter settings used by split_docs; the ingestion index invalidates its chunks when they change
+SPLIT_CONFIG = {"chunk_size": 4096, "over_lap": 512, "unit": "chars"}
+# Text extraction for HTML and Markdown: 'unstructured' (UnstructuredHTMLLoader, Markdown rendered to HTML and
+# re-parsed) or 'fast' (fast_extract); also part of what the ingestion index checks
+EXTRACTORS = ('unstructured', 'fast')
+LOAD_CONFIG = {"extractor": "unstructured"}
 
-def load_html(
-        folder_path: str,
-):
-    nltk.download('averaged_perceptron_tagger')
-    nltk.download('punkt')
-    html_files = glob.glob(os.path.join(folder_path, '**/*.html'), recursive=True)
+# Separator between documents packed into one request
+PACK_SEPARATOR = '\n\n-----\n\n'
+
+_encoding = None
+
+
+_nltk_ready = False
 
-    documents = []
-    for file_path in tqdm(html_files, desc='Loading HTML files'):
-        source = ''
-        for item in doc_list:
-            if item in file_path:
-                source = item
-        try:
-            content = UnstructuredHTMLLoader(file_path=file_path).load()
-            content[0].metadata["source"] = source
-            documents.append(content)
-        except:
-            continue
-    return documents
+
+# Download the NLTK data needed by UnstructuredHTMLLoader once per process, before any worker starts
+def ensure_nltk():
+    global _nltk_ready
+    if not _nltk_ready:
+        nltk.download('averaged_perceptron_tagger', quiet=True)
+        nltk.download('punkt', quiet=True)
+        _nltk_ready = True
+
+
+def get_source(file_path: str) -> str:
+    source = ''
+    for item in doc_list:
+        if item in file_path:
+            source = item
+    return source
 
 
 def md_to_text(md_content: str) -> str:
@@ -40,76 +67,283 @@ def md_to_text(md_content: str) -> str:
     return soup.get_text()
 
 
-def load_docs(folder_path: str):
-    md_files = glob.glob(os.path.join(folder_path, '**/*.md'), recursive=True)
-    documents = []
+# Per-file loaders; each returns a list of documents and raises on failure
+def load_html_file(file_path: str):
+    content = UnstructuredHTMLLoader(file_path=file_path).load()
+    content[0].metadata["source"] = get_source(file_path)
+    return [content]
+
+
+def load_md_file(file_path: str):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = md_to_text(file.read())
+    return [[Document(page_content=content, metadata={'source': get_source(file_path)})]]
 
-    for file_path in tqdm(md_files, desc='Loading Markdown files'):
-        source = ''
-        for item in doc_list:
-            if item in file_path:
-                source = item
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = md_to_text(file.read())
-            documents.append([Document(page_content=content, metadata={'source': source})])
-    return documents
 
+def load_text_file(file_path: str):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = file.read()
+    return [[Document(page_content=content, metadata={'source': get_source(file_path)})]]
 
-def load_text(folder_path: str):
-    text_files = glob.glob(os.path.join(folder_path, '**/*.txt'), recursive=True)
+
+def load_html_file_fast(file_path: str):
+    with open(file_path, 'rb') as file:
+        content = fast_extract.html_to_text(file.read())
+    return [[Document(page_content=content, metadata={'source': get_source(file_path)})]]
+
+
+def load_md_file_fast(file_path: str):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = fast_extract.markdown_to_text(file.read())
+    return [[Document(page_content=content, metadata={'source': get_source(file_path)})]]
+
+
+def load_pdf_file(file_path: str):
+    source = get_source(file_path)
     documents = []
-    for file_path in tqdm(text_files, desc='Loading Markdown files'):
-        source = ''
-        for item in doc_list:
-            if item in file_path:
-                source = item
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-            documents.append([Document(page_content=content, metadata={'source': source})])
+    for page in PyMuPDFLoader(file_path).lazy_load():
+        page.metadata['source'] = source
+        documents.append([page])
     return documents
 
 
-def load_pdfs(folder_path: str):
-    md_files = glob.glob(os.path.join(folder_path, '**/*.pdf'), recursive=True)
-    documents = []
-    for file_path in tqdm(md_files, desc='Loading PDF files'):
-        loader = PyMuPDFLoader(file_path)
-        content = loader.lazy_load()
-        source = ''
-        for item in doc_list:
-            if item in file_path:
-                source = item
-        for i in content:
-            i.metadata['source'] = source
-            documents.append([i])
+# File types in the order load_dataset returns them
+LOADERS = {
+    'html': load_html_file,
+    'md': load_md_file,
+    'pdf': load_pdf_file,
+    'txt': load_text_file,
+}
+# Loaders replacing LOADERS entries with the fast extractor
+FAST_LOADERS = {
+    'html': load_html_file_fast,
+    'md': load_md_file_fast,
+}
 
-    return documents
+
+def find_files(folder_path: str, extension: str):
+    return sorted(glob.glob(os.path.join(folder_path, f'**/*.{extension}'), recursive=True))
+
+
+# `extractor` is passed explicitly because worker processes do not share LOAD_CONFIG with the parent
+def _load_file(file_path: str, extractor: str = 'unstructured'):
+    extension = os.path.splitext(file_path)[1][1:]
+    loader = FAST_LOADERS.get(extension) if extractor == 'fast' else None
+    try:
+        return (loader or LOADERS[extension])(file_path), None
+    except Exception as e:
+        return [], f'{type(e).__name__}: {e}'
+
+
+# Function to load files across a process pool; returns one (documents, error) pair per path, in order
+def load_file_results(file_paths: list, workers: int = None, desc: str = 'Loading files'):
+    workers = workers or os.cpu_count() or 1
+    extractor = LOAD_CONFIG["extractor"]
+    if extractor == 'unstructured' and any(file_path.endswith('.html') for file_path in file_paths):
+        ensure_nltk()
+    if workers > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(file_paths) // (workers * 8))
+            return list(tqdm(executor.map(_load_file, file_paths, repeat(extractor), chunksize=chunksize),
+                             total=len(file_paths), desc=desc))
+    return [_load_file(file_path, extractor) for file_path in tqdm(file_paths, desc=desc)]
+
+
+def load_files(file_paths: list, workers: int = None, desc: str = 'Loading files'):
+    documents, failures = [], {}
+    for file_path, (docs, error) in zip(file_paths, load_file_results(file_paths, workers, desc)):
+        if error is None:
+            documents.extend(docs)
+        else:
+            failures[file_path] = error
+            logging.warning(f"Failed to load {file_path}: {error}")
+    return documents, failures
 
 
-def load_dataset(folder_path: str):
-    html = load_html(folder_path)
-    documents = load_docs(folder_path)
-    pdfs = load_pdfs(folder_path)
-    texts = load_text(folder_path)
-    dataset = html + documents + pdfs + texts
+def load_html(folder_path: str, workers: int = None):
+    return load_files(find_files(folder_path, 'html'), workers, desc='Loading HTML files')[0]
+
+
+def load_docs(folder_path: str, workers: int = None):
+    return load_files(find_files(folder_path, 'md'), workers, desc='Loading Markdown files')[0]
+
+
+def load_text(folder_path: str, workers: int = None):
+    return load_files(find_files(folder_path, 'txt'), workers, desc='Loading text files')[0]
+
+
+def load_pdfs(folder_path: str, workers: int = None):
+    return load_files(find_files(folder_path, 'pdf'), workers, desc='Loading PDF files')[0]
+
+
+def list_files(folder_path: str):
+    return [file_path for extension in LOADERS for file_path in find_files(folder_path, extension)]
+
+
+# Load every supported file in one pool so slow HTML/PDF parsing overlaps with the rest
+def load_dataset(folder_path: str, workers: int = None):
+    file_paths = list_files(folder_path)
+    with metrics.run.stage('load'):
+        dataset, failures = load_files(file_paths, workers, desc='Loading documents')
+    logging.info(f"Loaded {len(dataset)} documents from {len(file_paths) - len(failures)} files, "
+                 f"{len(failures)} files failed")
     return dataset
 
 
-def split_text(docs, chunk_size=4096, over_lap=512):
+# Streaming variant of load_dataset: yields documents file by file, in the same order, while at most
+# `prefetch` files per worker are parsed ahead of the consumer, so memory stays flat on large corpora.
+# The time spent in the generator itself, not in its consumer, is recorded as the 'load' stage.
+def iter_dataset(folder_path: str, workers: int = None, prefetch: int = 2):
+    seconds, start = 0.0, time.perf_counter()
+    file_paths = list_files(folder_path)
+    workers = workers or os.cpu_count() or 1
+    extractor = LOAD_CONFIG["extractor"]
+    if extractor == 'unstructured' and any(file_path.endswith('.html') for file_path in file_paths):
+        ensure_nltk()
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            paths = iter(file_paths)
+            for file_path in islice(paths, workers * prefetch):
+                pending.append((file_path, executor.submit(_load_file, file_path, extractor)))
+            while pending:
+                file_path, future = pending.popleft()
+                docs, error = future.result()
+                for next_path in islice(paths, 1):
+                    pending.append((next_path, executor.submit(_load_file, next_path, extractor)))
+                if error is not None:
+                    failed += 1
+                    logging.warning(f"Failed to load {file_path}: {error}")
+                    continue
+                for doc in docs:
+                    seconds += time.perf_counter() - start
+                    yield doc
+                    start = time.perf_counter()
+    finally:
+        metrics.run.add_stage('load', seconds + time.perf_counter() - start)
+    logging.info(f"Streamed {len(file_paths) - failed} files, {failed} files failed")
+
+
+# Bounded shuffle: keeps `window` items in a reservoir and emits a random one for every item read
+def reservoir_shuffle(items, window: int = 1024, seed: int = 0):
+    rng = random.Random(seed)
+    reservoir = []
+    for item in items:
+        if len(reservoir) < window:
+            reservoir.append(item)
+            continue
+        index = rng.randrange(window)
+        yield reservoir[index]
+        reservoir[index] = item
+    rng.shuffle(reservoir)
+    yield from reservoir
+
+
+# Token counting for the gpt-4o tokenizer; without tiktoken, ~4 characters per token is assumed
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        # Warned once: token budgets and TPM limits are only approximate without tiktoken
+        if tiktoken is None:
+            logging.warning("tiktoken is not installed (pip install tiktoken), estimating tokens from length")
+            _encoding = False
+        else:
+            try:
+                _encoding = tiktoken.get_encoding('o200k_base')
+            except Exception as e:
+                logging.warning(f"tiktoken encoding unavailable ({e}), estimating tokens from length")
+                _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def split_text(docs, chunk_size=4096, over_lap=512, unit='chars'):
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=over_lap,
-        length_function=len,
+        length_function=count_tokens if unit == 'tokens' else len,
         is_separator_regex=False,
     )
     return text_splitter.split_text(docs)
 
 
+# Function to split documents into chunks lazily; the time spent splitting, not reading `documents`, is
+# recorded as the 'split' stage once the documents are exhausted
+def iter_split_docs(documents):
+    seconds = 0.0
+    try:
+        for data in documents:
+            start = time.perf_counter()
+            source = data[0].metadata['source']
+            chunks = [Document(page_content=chunk, metadata={'source': source, 'chunk_id': chunk_id(chunk, source)})
+                      for chunk in split_text(data[0].page_content, **SPLIT_CONFIG)]
+            seconds += time.perf_counter() - start
+            yield from chunks
+    finally:
+        metrics.run.add_stage('split', seconds)
+
+
 def split_docs(documents: list):
-    split_sub_texts = []
-    for data in documents:
-        chunks = split_text(data[0].page_content)
-        for chunk in chunks:
-            split_sub_texts.append(Document(page_content=chunk, metadata={'source': data[0].metadata['source']}))
+    return list(iter_split_docs(documents))
+
+
+# Stable chunk ID: a content hash that also covers the source, so identical text from two tools stays distinct
+def chunk_id(content: str, source: str) -> str:
+    return hashlib.sha256(f'{source}\0{content}'.encode('utf-8')).hexdigest()[:20]
+
+
+# Deterministic shuffle: chunks are put in ID order first so the result only depends on the seed
+def shuffle_chunks(chunks: list, seed: int = 0):
+    chunks.sort(key=lambda chunk: chunk.metadata['chunk_id'])
+    random.Random(seed).shuffle(chunks)
+    return chunks
+
+
+# Pack small chunks of the same source into one request of at most `budget` tokens. Chunks of half the
+# budget or more are passed through unchanged. A packed chunk records the ID and character span of every
+# part in metadata['parts'], so generated items can be traced back to the document they came from.
+def pack_chunks(chunks, budget: int):
+    separator_tokens = count_tokens(PACK_SEPARATOR)
+    packs = {}
+    for chunk in chunks:
+        tokens = count_tokens(chunk.page_content)
+        if tokens >= budget // 2:
+            yield chunk
+            continue
+        source = chunk.metadata['source']
+        parts, used = packs.get(source, ([], 0))
+        if parts and used + tokens > budget:
+            yield _merge_chunks(parts)
+            parts, used = [], 0
+        parts.append(chunk)
+        packs[source] = (parts, used + tokens + separator_tokens)
+    for parts, _ in packs.values():
+        yield _merge_chunks(parts)
+
+
+def _merge_chunks(parts: list):
+    if len(parts) == 1:
+        return parts[0]
+    content, spans = '', []
+    for part in parts:
+        if content:
+            content += PACK_SEPARATOR
+        spans.append({'chunk_id': part.metadata['chunk_id'], 'start': len(content),
+                      'end': len(content) + len(part.page_content)})
+        content += part.page_content
+    source = parts[0].metadata['source']
+    return Document(page_content=content, metadata={'source': source, 'chunk_id': chunk_id(content, source),
+                                                    'parts': spans})
+
 
-    return split_sub_texts
+# Reference text for a generated item: the whole chunk, or for a packed chunk the part sharing most words with it
+def item_reference(chunk, item) -> str:
+    parts = chunk.metadata.get('parts')
+    if not parts:
+        return chunk.page_content
+    words = set(re.findall(r'\w+', json.dumps(item, ensure_ascii=False).lower()))
+    best = max(parts, key=lambda part: len(words & set(
+        re.findall(r'\w+', chunk.page_content[part['start']:part['end']].lower()))))
+    return chunk.page_content[best['start']:best['end']]
@@ -0,0 +1,49 @@
+import json
+import logging
+import os
+import time
+
+
+# Run manifest: an append-only JSONL file with one line per finished chunk.
+# On `--resume` the completed chunk IDs are loaded into a set, so skipping a chunk is an O(1) lookup
+# and an interrupted run only repeats the requests that were in flight when it stopped.
+class RunManifest:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = set()
+        if resume and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        self.completed.add(json.loads(line)['chunk_id'])
+                    except (json.JSONDecodeError, KeyError):
+                        # A torn last line from a killed run is simply ignored
+                        continue
+            logging.info(f"Resuming from {path}: {len(self.completed)} chunks already completed")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def is_done(self, chunk_id):
+        return chunk_id in self.completed
+
+    # Function to keep only the chunks that have not been completed yet
+    def pending(self, chunks):
+        remaining = [chunk for chunk in chunks if chunk.metadata['chunk_id'] not in self.completed]
+        if len(remaining) < len(chunks):
+            logging.info(f"Skipping {len(chunks) - len(remaining)} completed chunks, {len(remaining)} left")
+        return remaining
+
+    # Record a chunk as done; called only after its items have been written to the dataset
+    def mark_done(self, chunk, num_items):
+        record = {
+            "chunk_id": chunk.metadata['chunk_id'],
+            "source": chunk.metadata['source'],
+            "items": num_items,
+            "time": time.time(),
+        }
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.completed.add(record["chunk_id"])
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,235 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, float('inf'))
+# USD per 1M prompt / completion tokens, used for the cost estimate
+PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+}
+# USD per 1M prompt tokens served from the provider's prompt-prefix cache
+CACHED_PRICES = {
+    "gpt-4o": 1.25,
+    "gpt-4o-mini": 0.075,
+}
+
+# Source (EDA tool) of the chunk being processed; set by the async engine for every chunk so API calls and
+# parse failures can be attributed without passing the source through every function
+current_source = contextvars.ContextVar('current_source', default=None)
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Function to read the prompt tokens the provider served from its prefix cache (`prompt_tokens_details`)
+def _cached_tokens(usage):
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+
+
+def _ratio(part, whole):
+    return part / whole if whole else None
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Metrics of one run. Stage times are summed over calls, so stages that run concurrently (llm, parse, write)
+# can add up to more than the run's wall time; `elapsed` is the wall time. Counters are broken down by source.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.started = time.time()
+        self.stages = defaultdict(lambda: {"seconds": 0.0, "calls": 0})
+        self.buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self.latency_sum = Counter()
+        self.latencies = []
+        self.tokens = defaultdict(Counter)
+        self.model_tokens = defaultdict(Counter)
+        self.counters = defaultdict(Counter)
+        self.items_per_chunk = defaultdict(Counter)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name]["seconds"] += seconds
+            self.stages[name]["calls"] += 1
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def count(self, name, amount=1, source=None):
+        with self._lock:
+            self.counters[name][source or current_source.get()] += amount
+
+    # Record one completed API request with its latency and the `completion.usage` it reported
+    def observe_request(self, seconds, usage=None, model=None):
+        source = current_source.get()
+        self.add_stage('llm', seconds)
+        with self._lock:
+            bucket = next(index for index, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)
+            self.buckets[source][bucket] += 1
+            self.latency_sum[source] += seconds
+            self.latencies.append(seconds)
+            if usage is not None:
+                for kind in ('prompt_tokens', 'completion_tokens'):
+                    self.tokens[source][kind] += getattr(usage, kind, 0) or 0
+                    self.model_tokens[model][kind] += getattr(usage, kind, 0) or 0
+                cached = _cached_tokens(usage)
+                self.tokens[source]['cached_tokens'] += cached
+                self.model_tokens[model]['cached_tokens'] += cached
+
+    # Record a finished chunk; `items` is None for a chunk that failed
+    def observe_chunk(self, source, items):
+        with self._lock:
+            if items is None:
+                self.counters['failed_chunks'][source] += 1
+            else:
+                self.items_per_chunk[source][items] += 1
+
+    def cost(self):
+        total = 0.0
+        for model, tokens in self.model_tokens.items():
+            prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+            cached_price = CACHED_PRICES.get(model, prompt_price)
+            total += ((tokens['prompt_tokens'] - tokens['cached_tokens']) * prompt_price
+                      + tokens['cached_tokens'] * cached_price + tokens['completion_tokens'] * completion_price) / 1e6
+        return total
+
+    def report(self, extra=None):
+        with self._lock:
+            sources = sorted(set(self.buckets) | set(self.items_per_chunk) | set(self.tokens)
+                             | {source for counter in self.counters.values() for source in counter}, key=str)
+            by_source = {}
+            for source in sources:
+                sizes = self.items_per_chunk.get(source, Counter())
+                chunks = sum(sizes.values())
+                items = sum(size * count for size, count in sizes.items())
+                tokens = self.tokens.get(source, Counter())
+                by_source[str(source)] = {
+                    "requests": sum(self.buckets.get(source, ())),
+                    "latency_seconds": self.latency_sum[source],
+                    **dict(tokens),
+                    "prompt_cache_hit_ratio": _ratio(tokens['cached_tokens'], tokens['prompt_tokens']),
+                    "prompt_tokens_per_chunk": _ratio(tokens['prompt_tokens'], chunks),
+                    "completion_tokens_per_chunk": _ratio(tokens['completion_tokens'], chunks),
+                    "chunks": chunks,
+                    "items": items,
+                    "items_per_chunk": items / chunks if chunks else None,
+                    "items_per_chunk_histogram": {str(size): count for size, count in sorted(sizes.items())},
+                    **{name: counter[source] for name, counter in self.counters.items() if counter[source]},
+                }
+            tokens = Counter()
+            for model_tokens in self.model_tokens.values():
+                tokens.update(model_tokens)
+            chunks = sum(sum(sizes.values()) for sizes in self.items_per_chunk.values())
+            report = {
+                "started": self.started,
+                "elapsed_seconds": time.perf_counter() - self._start,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "requests": len(self.latencies),
+                "latency_p50": _percentile(self.latencies, 0.5),
+                "latency_p99": _percentile(self.latencies, 0.99),
+                "tokens": {str(model): dict(tokens) for model, tokens in self.model_tokens.items()},
+                # Share of prompt tokens served from the provider's prefix cache, and tokens spent per finished chunk
+                "prompt_cache_hit_ratio": _ratio(tokens['cached_tokens'], tokens['prompt_tokens']),
+                "prompt_tokens_per_chunk": _ratio(tokens['prompt_tokens'], chunks),
+                "completion_tokens_per_chunk": _ratio(tokens['completion_tokens'], chunks),
+                "estimated_cost_usd": self.cost(),
+                "totals": {name: sum(counter.values()) for name, counter in self.counters.items()},
+                "by_source": by_source,
+            }
+        report.update(extra or {})
+        return report
+
+    # Function to render the metrics in the Prometheus text exposition format
+    def prometheus(self, prefix='edacopilot'):
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+
+        with self._lock:
+            metric('stage_seconds_total', 'counter', 'Seconds spent per pipeline stage, summed over calls')
+            for name, stage in sorted(self.stages.items()):
+                lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}')
+            metric('request_latency_seconds', 'histogram', 'LLM request latency')
+            for source, buckets in sorted(self.buckets.items(), key=lambda item: str(item[0])):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'{prefix}_request_latency_seconds_bucket{{source="{_label(source)}",le="{le}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{prefix}_request_latency_seconds_sum{{source="{_label(source)}"}} '
+                             f'{self.latency_sum[source]:.6f}')
+                lines.append(f'{prefix}_request_latency_seconds_count{{source="{_label(source)}"}} {cumulative}')
+            metric('tokens_total', 'counter', 'Tokens reported by completion.usage')
+            for source, tokens in sorted(self.tokens.items(), key=lambda item: str(item[0])):
+                for kind, count in sorted(tokens.items()):
+                    lines.append(f'{prefix}_tokens_total{{source="{_label(source)}",kind="{kind}"}} {count}')
+            # Each metric family's samples must directly follow its own HELP/TYPE header
+            per_chunk = sorted(self.items_per_chunk.items(), key=lambda item: str(item[0]))
+            metric('items_total', 'counter', 'Dataset items generated')
+            for source, sizes in per_chunk:
+                items = sum(size * count for size, count in sizes.items())
+                lines.append(f'{prefix}_items_total{{source="{_label(source)}"}} {items}')
+            metric('chunks_total', 'counter', 'Chunks that produced a result')
+            for source, sizes in per_chunk:
+                lines.append(f'{prefix}_chunks_total{{source="{_label(source)}"}} {sum(sizes.values())}')
+            for name, counter in sorted(self.counters.items()):
+                metric(f'{name}_total', 'counter', f'Number of {name.replace("_", " ")}')
+                for source, count in sorted(counter.items(), key=lambda item: str(item[0])):
+                    lines.append(f'{prefix}_{name}_total{{source="{_label(source)}"}} {count}')
+        metric('estimated_cost_usd', 'gauge', 'Estimated API cost of the run')
+        lines.append(f'{prefix}_estimated_cost_usd {self.cost():.6f}')
+        return '\n'.join(lines) + '\n'
+
+    # Function to write the JSON run report and the Prometheus textfile; both are replaced atomically
+    def write(self, report_path, prometheus_path=None, extra=None):
+        outputs = [(report_path, json.dumps(self.report(extra), ensure_ascii=False, indent=2, default=str))]
+        if prometheus_path:
+            outputs.append((prometheus_path, self.prometheus()))
+        for path, content in outputs:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+                file.write(content)
+            os.replace(f'{path}.tmp', path)
+
+    def log_summary(self):
+        report = self.report()
+        stages = ', '.join(f"{name} {stage['seconds']:.1f}s" for name, stage in report["stages"].items())
+        tokens = Counter()
+        for model_tokens in report["tokens"].values():
+            tokens.update(model_tokens)
+        p50, p99 = report["latency_p50"], report["latency_p99"]
+        hit_ratio, per_chunk = report["prompt_cache_hit_ratio"], report["prompt_tokens_per_chunk"]
+        logging.info(f"Run metrics: {report['elapsed_seconds']:.1f}s wall; stages: {stages or 'none'}; "
+                     f"{report['requests']} requests"
+                     + (f" (p50 {p50:.2f}s, p99 {p99:.2f}s)" if p50 is not None else "")
+                     + f"; {tokens['prompt_tokens']} prompt + {tokens['completion_tokens']} completion tokens"
+                     + (f" ({hit_ratio:.0%} of prompt tokens cached)" if hit_ratio is not None else "")
+                     + (f", {per_chunk:.0f} prompt tokens per chunk" if per_chunk is not None else "")
+                     + f", ~${report['estimated_cost_usd']:.2f}")
+
+
+# Metrics of the current process
+run = Metrics()
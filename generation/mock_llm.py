@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Words used to fill generated items, so outputs vary with the chunk they came from
+_WORD_PATTERN = re.compile(r'[A-Za-z_][\w:-]{3,}')
+# A Tcl/shell-style command with a flag, e.g. `set_clock_uncertainty -setup 0.1`
+_COMMAND_PATTERN = re.compile(r'^\s*[a-z][\w:]*_[\w:]* .*-\w+', re.MULTILINE)
+# Roughly 4 characters per token, like load_data's estimate without tiktoken
+_CHARS_PER_TOKEN = 4
+# Prompt-prefix cache granularity: cached prefixes grow in steps of this many tokens
+_CACHE_BLOCK_TOKENS = 128
+
+
+def _words(text, rng, count):
+    words = _WORD_PATTERN.findall(text) or ['design']
+    return ' '.join(rng.choice(words) for _ in range(count))
+
+
+# Function to build a well-formed answer for whichever prompt of the pipeline `sys_prompt` is
+def canned_items(sys_prompt, user_prompt, rng):
+    # script_fused holds the script instructions and the script_judge answer for chunks without scripts
+    if 'script_found' in sys_prompt and 'script_paradigm' not in sys_prompt:
+        return {"script_found": bool(_COMMAND_PATTERN.search(user_prompt))}
+    if 'knowledge_advice_question' in sys_prompt:
+        return {"knowledge_advice_question": f"How should {_words(user_prompt, rng, 3)} be configured?",
+                "knowledge_advice_answer": _words(user_prompt, rng, 40),
+                "topic": rng.choice(['Timing Closure', 'Power Optimization', 'Area Optimization'])}
+    if 'code_paradigm' in sys_prompt:
+        return {"definition_description": _words(user_prompt, rng, 12),
+                "functionality_description": _words(user_prompt, rng, 30),
+                "inputs": {"design": _words(user_prompt, rng, 6)},
+                "outputs": _words(user_prompt, rng, 8),
+                "code_paradigm": _words(user_prompt, rng, 10)}
+    if 'script_paradigm' in sys_prompt:
+        commands = [line.strip() for line in _COMMAND_PATTERN.findall(user_prompt)]
+        if not commands and 'script_found' in sys_prompt:
+            return {"script_found": False}
+        commands = commands or [_words(user_prompt, rng, 3)]
+        return [{"script_name": command.split()[0],
+                 "definition_description": _words(user_prompt, rng, 12),
+                 "parameters": {"value": _words(user_prompt, rng, 6)},
+                 "values": "value: <value>",
+                 "script_paradigm": f"{command.split()[0]} <value>",
+                 "examples": [{"query": f"How to run {command.split()[0]}?", "answer": command}]}
+                for command in commands[:rng.randint(1, 3)]]
+    return [{"type": rng.choice(['Terminology explanation', 'Knowledge advice']),
+             "query": f"What does {_words(user_prompt, rng, 3)} do?",
+             "answer": _words(user_prompt, rng, 40)}
+            for _ in range(rng.randint(1, 4))]
+
+
+# Function to render the completion text, damaged the way real completions sometimes are
+def render(items, rng, malformed_rate):
+    text = json.dumps(items, ensure_ascii=False, indent=4)
+    if rng.random() >= malformed_rate:
+        return f"```json\n{text}\n```"
+    kind = rng.choice(['truncated', 'unfenced', 'trailing_comma', 'prose'])
+    if kind == 'truncated':
+        return f"```json\n{text[:max(1, int(len(text) * rng.uniform(0.5, 0.95)))]}"
+    if kind == 'unfenced':
+        return f"Here is the result:\n{text}"
+    if kind == 'trailing_comma':
+        return f"```json\n{text[:-1].rstrip()},\n{text[-1]}\n```"
+    return "I'm sorry, I could not find anything to extract from this content."
+
+
+# Local stand-in for an OpenAI-compatible chat completions endpoint. Each request sleeps for a log-normally
+# distributed latency (median `latency_ms`), fails with 429 + Retry-After or 500 at the given rates, and otherwise
+# returns a canned answer for the pipeline prompt it received, malformed at `malformed_rate`. Usage reports the
+# prompt tokens a provider-side prefix cache would have served (`prompt_tokens_details.cached_tokens`): like
+# OpenAI's, it caches prompts of at least `prefix_cache_min_tokens` in 128-token steps; None disables it.
+class MockLLMServer:
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=500, latency_sigma=0.5, rate_limit_rate=0.0,
+                 error_rate=0.0, malformed_rate=0.0, retry_after=1, seed=0, prefix_cache_min_tokens=1024):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.prefix_cache_min_tokens = prefix_cache_min_tokens
+        self.stats = Counter()
+        self._prefixes = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    # Function to draw everything random about one request under the lock, so runs are reproducible per seed
+    def _draw(self):
+        with self._lock:
+            latency = self.latency_ms / 1000 * self._rng.lognormvariate(0, self.latency_sigma)
+            outcome = self._rng.random()
+            return latency, outcome, random.Random(self._rng.getrandbits(64))
+
+    # Function to count the prompt tokens served from the prefix cache: the longest prefix, at a block boundary
+    # from the minimum length on, that an earlier request already sent
+    def _cached_tokens(self, prompt):
+        if self.prefix_cache_min_tokens is None:
+            return 0
+        block = _CACHE_BLOCK_TOKENS * _CHARS_PER_TOKEN
+        digest = hashlib.sha256()
+        keys, position = [], 0
+        for end in range(max(block, self.prefix_cache_min_tokens * _CHARS_PER_TOKEN), len(prompt) + 1, block):
+            digest.update(prompt[position:end].encode('utf-8'))
+            position = end
+            keys.append((end, digest.hexdigest()))
+        with self._lock:
+            cached = max((end for end, key in keys if key in self._prefixes), default=0)
+            self._prefixes.update(key for _, key in keys)
+        return cached // _CHARS_PER_TOKEN
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _complete(self, body):
+        latency, outcome, rng = self._draw()
+        time.sleep(latency)
+        if outcome < self.rate_limit_rate:
+            self._count("rate_limited")
+            return 429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                   "code": "rate_limit_exceeded"}}
+        if outcome < self.rate_limit_rate + self.error_rate:
+            self._count("errors")
+            return 500, {"error": {"message": "The server had an error processing your request",
+                                   "type": "server_error"}}
+        messages = body.get("messages", [])
+        sys_prompt = next((message["content"] for message in messages if message["role"] == "system"), '')
+        user_prompt = next((message["content"] for message in messages if message["role"] == "user"), '')
+        content = render(canned_items(sys_prompt, user_prompt, rng), rng, self.malformed_rate)
+        cached = self._cached_tokens(sys_prompt + user_prompt)
+        self._count("completions")
+        self._count("cached_tokens", cached)
+        return 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": (len(sys_prompt) + len(user_prompt)) // _CHARS_PER_TOKEN,
+                      "completion_tokens": len(content) // _CHARS_PER_TOKEN,
+                      "total_tokens": (len(sys_prompt) + len(user_prompt) + len(content)) // _CHARS_PER_TOKEN,
+                      "prompt_tokens_details": {"cached_tokens": cached}},
+        }
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path.rstrip('/').endswith('/chat/completions'):
+                    status, payload = mock._complete(body)
+                else:
+                    status, payload = 404, {"error": {"message": f"Unknown endpoint {self.path}"}}
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if status == 429:
+                    self.send_header('Retry-After', str(mock.retry_after))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a local OpenAI-compatible mock of the chat completions API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency-ms', type=float, default=500, help='Median request latency')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Sigma of the log-normal latency')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+    parser.add_argument('--malformed', type=float, default=0.0, help='Fraction of completions with broken JSON')
+    parser.add_argument('--prefix-cache-min-tokens', type=int, default=1024,
+                        help='Shortest prompt the simulated prefix cache serves (OpenAI: 1024; vLLM-style servers '
+                             'cache any shared block, use 0)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = MockLLMServer(args.host, args.port, args.latency_ms, args.latency_sigma, args.rate_limit,
+                           args.error_rate, args.malformed, seed=args.seed,
+                           prefix_cache_min_tokens=args.prefix_cache_min_tokens)
+    logging.info(f"Mock LLM listening on {server.url}; set OPENAI_API_URL={server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    logging.info(f"Served: {dict(server.stats)}")
@@ -1,19 +1,28 @@
-import time
 from tqdm import tqdm
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
 
+import governor
+import llm_cache
+import metrics
+
 CONFIG = {
     "api_key": os.environ.get("OPENAI_API_KEY"),
     "base_url": os.environ.get("OPENAI_API_URL"),
+    "model": "gpt-4o",
     "token_limit": 4096,
-    "retry_limit": 3
+    "retry_limit": 3,
+    "concurrency": int(os.environ.get("OPENAI_CONCURRENCY", 16))
 }
 
-client = OpenAI(api_key=CONFIG["api_key"], base_url=CONFIG["base_url"])
+# Retries are left to the governor, which sees every 429 and shares the backoff across requests
+client = OpenAI(api_key=CONFIG["api_key"], base_url=CONFIG["base_url"], max_retries=0)
+async_client = AsyncOpenAI(api_key=CONFIG["api_key"], base_url=CONFIG["base_url"], max_retries=0)
+cache = llm_cache.from_env()
+limiter = governor.from_env()
 
 cums_sys_prompt = {"qa": """
-You will act as an EDA tool expert, extracting key information from {} tool documentation or community discussions to create a series of Q&A pairs. 
+You will act as an EDA tool expert, extracting key information from the documentation or community discussions of the EDA tool named at the end of these instructions to create a series of Q&A pairs. 
 Each Q&A pair must accurately reflect the content from the documentation or discussions, and the output must follow the JSON format. 
 The `type` of each Q&A pair must be one of the following two types:
 
@@ -47,7 +56,7 @@ Output format:
 Ensure each question and answer is accurately aligned with the documentation or discussion content, avoiding vague or overly general responses.
 """,
                    "script": """ 
-                   You are an EDA tool script usage expert. Your task is to generate script descriptions in the specified format based on the content of the provided {} EDA tool documentation. Each script description should include the following fields:
+                   You are an EDA tool script usage expert. Your task is to generate script descriptions in the specified format based on the content of the provided documentation of the EDA tool named at the end of these instructions. Each script description should include the following fields:
 
 ```json
 [
@@ -98,7 +107,7 @@ Ensure each question and answer is accurately aligned with the documentation or
 And ensure that values in the script description do not contain single quotes and that all parameters are enclosed in < > to avoid any issues with JSON parsing
 """,
                    "script_judge": """
-You are an EDA tool script usage expert. Your task is to determine if the provided {} tool content contains any extractable scripts. If the content contains scripts, return the flag "script_found": true; if not, return the flag "script_found": false.
+You are an EDA tool script usage expert. Your task is to determine if the provided content of the EDA tool named at the end of these instructions contains any extractable scripts. If the content contains scripts, return the flag "script_found": true; if not, return the flag "script_found": false.
 
 Output format:
 
@@ -108,19 +117,64 @@ Output format:
 }
 ```
                    """}
+# Single-call alternative to script_judge followed by script: the extraction instructions, told to answer with the
+# script_judge result when there is nothing to extract
+cums_sys_prompt["script_fused"] = cums_sys_prompt["script"].rstrip() + """
+
+If the content contains no extractable scripts, do not invent any and return only:
+
+```json
+{
+    "script_found": false
+}
+```
+"""
+
 
+# Function to build the system prompt `name` for a chunk of `source`. The instructions are the same for every
+# request and come first, so the provider's prompt-prefix cache can reuse them; only the last line names the tool.
+def system_prompt(name, source):
+    return f"{cums_sys_prompt[name].rstrip()}\n\nThe content is from the {source} tool documentation.\n"
 
-def chat_gpt_api(sys_prompt, user_prompt):
-    while True:
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": sys_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-            return completion.choices[0].message.content
-        except:
-            time.sleep(1)
-            continue
+
+# Look up a cached completion; `use_cache=False` skips the lookup (e.g. when retrying a bad response)
+def cached_response(sys_prompt, user_prompt, use_cache=True):
+    key = cache.key(CONFIG["model"], sys_prompt, user_prompt)
+    if not use_cache:
+        if cache.mode == 'replay':
+            raise llm_cache.CacheMiss(f"Cannot refresh {key} in replay mode")
+        metrics.run.count('retries')
+        return key, None
+    return key, cache.get(key)
+
+
+def chat_gpt_api(sys_prompt, user_prompt, use_cache=True):
+    key, response = cached_response(sys_prompt, user_prompt, use_cache)
+    if response is not None:
+        return response
+    completion = limiter.call(lambda: client.chat.completions.create(
+        model=CONFIG["model"],
+        messages=[
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    ), sys_prompt + user_prompt, CONFIG["model"])
+    response = completion.choices[0].message.content
+    cache.put(key, CONFIG["model"], response)
+    return response
+
+
+async def async_chat_gpt_api(sys_prompt, user_prompt, use_cache=True):
+    key, response = cached_response(sys_prompt, user_prompt, use_cache)
+    if response is not None:
+        return response
+    completion = await limiter.call_async(lambda: async_client.chat.completions.create(
+        model=CONFIG["model"],
+        messages=[
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    ), sys_prompt + user_prompt, CONFIG["model"])
+    response = completion.choices[0].message.content
+    cache.put(key, CONFIG["model"], response)
+    return response
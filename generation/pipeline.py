@@ -0,0 +1,194 @@
+import argparse
+import logging
+import os
+
+import dataset_writer
+import dedup
+import ingest_index
+import json_salvage
+import load_data
+import metrics
+import openai_api
+import reference_store
+import shards
+
+
+# Command-line options shared by qa_generation.py and script_format_generation.py
+def parse_args(description, data_path, output_path, add_arguments=None):
+    parser = argparse.ArgumentParser(description=description)
+    if add_arguments:
+        add_arguments(parser)
+    parser.add_argument('--data-path', default=data_path)
+    parser.add_argument('--output-path', default=output_path)
+    parser.add_argument('--concurrency', type=int, default=openai_api.CONFIG["concurrency"],
+                        help='Number of API requests in flight')
+    parser.add_argument('--load-workers', type=int, default=None,
+                        help='Processes used to parse documents (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the chunk ordering')
+    parser.add_argument('--resume', action='store_true', help='Skip chunks recorded in the run manifest')
+    parser.add_argument('--shard', type=shards.parse_shard, default=None, metavar='I/N',
+                        help='Only generate from shard I of N of the chunks (by a stable hash of content and source); '
+                             'outputs go to <output-path>/shard-I-of-N, combine them with shards.py')
+    parser.add_argument('--batch', choices=['export', 'ingest'], default=None,
+                        help='Write Batch API request files instead of calling the API, or ingest downloaded results')
+    parser.add_argument('--batch-dir', default=None,
+                        help='Directory for batch request files; results go to <batch-dir>/results '
+                             '(default: <output-path>/batch)')
+    parser.add_argument('--durability', choices=dataset_writer.DURABILITY, default='flush',
+                        help='When written records are flushed/fsynced to disk')
+    parser.add_argument('--rotate-records', type=int, default=None,
+                        help='Start a new output shard after this many records')
+    parser.add_argument('--rotate-mb', type=float, default=None,
+                        help='Start a new output shard once a shard reaches this size')
+    parser.add_argument('--compact', action='store_true',
+                        help='Store each reference once in <name>_chunks.jsonl and only its reference_id in records')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--incremental', action='store_true',
+                        help='Only parse changed files and only generate from chunks not generated before')
+    source.add_argument('--stream', action='store_true',
+                        help='Stream documents and chunks into generation instead of loading the corpus first')
+    parser.add_argument('--dedup-threshold', type=float, default=None,
+                        help='Drop chunks whose MinHash similarity to an earlier chunk reaches this value (e.g. 0.8)')
+    parser.add_argument('--extractor', choices=load_data.EXTRACTORS, default='unstructured',
+                        help='Text extraction for HTML and Markdown; "fast" uses lxml and a direct Markdown stripper')
+    parser.add_argument('--split-by', choices=['chars', 'tokens'], default='chars',
+                        help='Measure chunks in characters, or in tokens within CONFIG["token_limit"]')
+    parser.add_argument('--pack', action='store_true',
+                        help='Pack small chunks of the same source into one request up to the token budget')
+    parser.add_argument('--shuffle-window', type=int, default=1024,
+                        help='Reservoir size used to shuffle chunks in streaming mode')
+    parser.add_argument('--queue-size', type=int, default=256,
+                        help='Chunks buffered between the splitter and the API workers in streaming mode')
+    parser.add_argument('--prometheus-textfile', default=None,
+                        help='Write the run metrics to this Prometheus textfile '
+                             '(default: <output-path>/<name>_metrics.prom)')
+    args = parser.parse_args()
+    if args.shard:
+        args.output_path = os.path.join(args.output_path, shards.shard_dir(*args.shard))
+    args.batch_dir = args.batch_dir or f'{args.output_path}/batch'
+    return args
+
+
+# Function to tell whether a run adds to the dataset and run manifest already in the output path (--resume,
+# --incremental, batch ingest) or starts both over. The two are always kept or truncated together, so the
+# manifest never claims chunks whose records are gone, nor misses records that are still in the dataset.
+# Batch export generates nothing and keeps both, so its ingest still skips the chunks finished earlier.
+def appends(args):
+    return bool(args.resume or args.incremental or args.batch)
+
+
+def open_writer(args, file_name, append):
+    return dataset_writer.DatasetWriter(
+        f'{args.output_path}/{file_name}',
+        max_records=args.rotate_records,
+        max_bytes=int(args.rotate_mb * 1024 * 1024) if args.rotate_mb else None,
+        durability=args.durability,
+        append=append,
+    )
+
+
+# With --compact, references are moved out of the records into a chunks file next to the dataset
+def open_reference_store(args, file_name, append):
+    if not args.compact:
+        return None
+    return reference_store.ReferenceStore(reference_store.chunks_path_for(f'{args.output_path}/{file_name}'),
+                                          durability=args.durability, append=append)
+
+
+# Chunk source for a run: builds the chunks (a lazy iterator in streaming mode, otherwise a list) and owns
+# the ingestion index and near-duplicate filter that go with them. With `load=False` no documents are read;
+# only the ingestion index is opened, e.g. to record chunks generated through the Batch API.
+class ChunkSource:
+    def __init__(self, args, run_manifest, sys_prompt, load=True):
+        self.index = None
+        self.dedup = None
+        self.chunks = []
+        self.shard = args.shard
+        load_data.LOAD_CONFIG["extractor"] = args.extractor
+        # Tokens left for the chunk once the system prompt is counted against CONFIG["token_limit"]
+        self.budget = openai_api.CONFIG["token_limit"] - load_data.count_tokens(sys_prompt)
+        # Set before the ingestion index is opened, which compares the split config with the one it was built with
+        if args.split_by == 'tokens':
+            load_data.SPLIT_CONFIG.update(chunk_size=self.budget, over_lap=self.budget // 8, unit='tokens')
+        if not load:
+            if args.incremental:
+                self.index = ingest_index.IngestIndex(f'{args.output_path}/ingest_index.sqlite')
+            return
+        if args.dedup_threshold:
+            self.dedup = dedup.NearDuplicateFilter(threshold=args.dedup_threshold)
+
+        if args.stream:
+            documents = load_data.iter_dataset(args.data_path, workers=args.load_workers)
+            chunks = self.in_shard(load_data.iter_split_docs(documents))
+            chunks = load_data.reservoir_shuffle(chunks, args.shuffle_window, args.seed)
+            if self.dedup:
+                chunks = self.dedup.filter(chunks)
+            if args.pack:
+                chunks = load_data.pack_chunks(chunks, self.budget)
+            self.chunks = (chunk for chunk in chunks if not run_manifest.is_done(chunk.metadata['chunk_id']))
+            return
+
+        if args.incremental:
+            self.index = ingest_index.IngestIndex(f'{args.output_path}/ingest_index.sqlite')
+            with metrics.run.stage('load'):
+                all_chunks, chunks = self.index.refresh(args.data_path, workers=args.load_workers)
+            all_chunks, chunks = list(self.in_shard(all_chunks)), list(self.in_shard(chunks))
+            if self.dedup:
+                # New chunks are compared against everything generated in earlier runs as well
+                new_ids = {chunk.metadata['chunk_id'] for chunk in chunks}
+                for chunk in all_chunks:
+                    if chunk.metadata['chunk_id'] not in new_ids:
+                        self.dedup.add(chunk)
+        else:
+            dataset = load_data.load_dataset(args.data_path, workers=args.load_workers)
+            chunks = list(self.in_shard(load_data.split_docs(dataset)))
+        if self.shard:
+            logging.info(f"Shard {self.shard[0]}/{self.shard[1]}: {len(chunks)} chunks")
+        load_data.shuffle_chunks(chunks, args.seed)
+        if self.dedup:
+            chunks = list(self.dedup.filter(chunks))
+        if args.pack:
+            chunks = list(load_data.pack_chunks(chunks, self.budget))
+            logging.info(f"Packed into {len(chunks)} requests of at most {self.budget} tokens")
+        self.chunks = run_manifest.pending(chunks)
+
+    # Function to keep only the chunks of this worker's shard; chunks are sharded before packing, so a packed
+    # request never mixes shards
+    def in_shard(self, chunks):
+        if not self.shard:
+            return chunks
+        return (chunk for chunk in chunks if shards.in_shard(chunk, self.shard))
+
+    def mark_generated(self, chunk):
+        if self.index:
+            for part in chunk.metadata.get('parts', [chunk.metadata]):
+                self.index.mark_generated(part['chunk_id'])
+
+    def close(self):
+        if self.dedup:
+            self.dedup.report()
+        if self.index:
+            self.index.close()
+
+
+# Function to request a completion for `chunk` and parse it with the json_salvage `schema`. Unparsable responses
+# are retried up to `max_retries` times; API errors were already retried by the governor and propagate to the
+# engine, which fails the chunk. Returns None if every response was unparsable.
+async def async_get_api_response_with_retry(prompt, chunk, schema, max_retries=3):
+    for retry_count in range(max_retries):
+        try:
+            # A cached response that failed to parse is not served again on retry
+            response = await openai_api.async_chat_gpt_api(prompt, chunk, use_cache=retry_count == 0)
+            # Truncated or slightly malformed JSON is repaired instead of paying for a new completion
+            return json_salvage.parse(response, schema)
+        except ValueError as ve:
+            logging.warning(f"ValueError encountered: {ve}. Retrying...")
+    return None
+
+
+# Function to write the run report (`<name>_run_report.json`) and Prometheus textfile of a finished run
+def write_metrics(args, name):
+    extra = {"cache": openai_api.cache.stats(), "json_parsing": dict(json_salvage.stats)}
+    metrics.run.write(f'{args.output_path}/{name}_run_report.json',
+                      args.prometheus_textfile or f'{args.output_path}/{name}_metrics.prom', extra)
+    metrics.run.log_summary()
@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+import dataset_index
+import dataset_writer
+import reference_store
+
+# Words that carry no support for an answer
+_STOPWORDS = frozenset(
+    'a an and are as at be by can do does for from has have how i if in into is it its of on or so than that the '
+    'their them then there these this to use used uses using was what when where which while with you your'.split()
+)
+_WORD_PATTERN = re.compile(r'[a-z0-9][\w:.-]*[a-z0-9]|[a-z0-9]')
+_NORMALIZE_PATTERN = re.compile(r'[\W_]+')
+# Commands, options and API names: `set_clock_uncertainty`, `-max_paths`, `pdn::add_stripe`, `getBlock`
+_IDENTIFIER_PATTERN = re.compile(r'(?<![\w-])-?[A-Za-z_]\w*(?:::\w+)*')
+_CAMEL_PATTERN = re.compile(r'[a-z][A-Z]')
+# Odd multiplier of the n-gram hash mix (the 64-bit golden ratio)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+# Similarity blocks stay below this many (row, column) cells
+_BLOCK_CELLS = 1 << 22
+# Buckets of more vectors than this are compared as blocks instead of pair by pair
+_LARGE_BUCKET = 64
+# Candidate pairs scored per batch
+_PAIR_BATCH = 1 << 18
+# Texts hashed per batch when building vectors
+_VECTOR_BATCH = 50000
+
+
+def normalize(text):
+    return _NORMALIZE_PATTERN.sub(' ', text.lower()).strip()
+
+
+# Function to turn texts into L2-normalized, signed feature-hashed vectors of their character n-grams. The texts
+# of a batch are concatenated into one byte array and every n-gram is hashed with array arithmetic, so no Python
+# code runs per n-gram.
+def char_ngram_vectors(texts, dim=256, n=3):
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for start in range(0, len(texts), _VECTOR_BATCH):
+        encoded = [f' {text} '.encode('utf-8') for text in texts[start:start + _VECTOR_BATCH]]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+        if len(data) < n:
+            continue
+        ends = np.cumsum(lengths)
+        positions = np.arange(len(data) - n + 1)
+        rows = np.searchsorted(ends, positions, side='right')
+        # Drop the n-grams that run into the next text
+        valid = positions + n <= ends[np.minimum(rows, len(ends) - 1)]
+        hashes = np.zeros(len(positions), dtype=np.uint64)
+        for offset in range(n):
+            hashes = hashes * np.uint64(257) + data[offset:offset + len(positions)]
+        hashes = hashes[valid] * _MIX
+        buckets = (hashes >> np.uint64(40)) % np.uint64(dim)
+        signs = np.where(hashes & np.uint64(1 << 39), 1.0, -1.0)
+        batch = np.bincount(rows[valid] * dim + buckets.astype(np.int64), weights=signs,
+                            minlength=len(encoded) * dim).reshape(len(encoded), dim)
+        norms = np.linalg.norm(batch, axis=1, keepdims=True)
+        vectors[start:start + len(encoded)] = batch / np.where(norms > 0, norms, 1)
+    return vectors
+
+
+# Pick the random-hyperplane LSH split for `count` vectors: enough bits per band that unrelated vectors rarely share
+# a bucket, and enough bands that a pair at the similarity threshold shares one with probability `recall`
+def lsh_params(threshold, count, recall=0.95):
+    bits = min(26, max(8, math.ceil(math.log2(max(count, 2))) + 2))
+    agree = (1 - math.acos(min(1.0, threshold)) / math.pi) ** bits
+    bands = math.ceil(math.log(1 - recall) / math.log(1 - agree)) if agree < 1 else 1
+    return max(1, bands), bits
+
+
+# Function to return the candidate pairs (i < j) of one band: every pair of vectors in the same bucket. Pairs of
+# small buckets are enumerated with array operations, one offset within the sorted buckets at a time; buckets
+# larger than `_LARGE_BUCKET` are returned separately and compared as blocks.
+def _bucket_pairs(keys):
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+    starts, ends = np.concatenate(([0], bounds)), np.concatenate((bounds, [len(keys)]))
+    sizes = ends - starts
+    large = [order[start:end] for start, end in zip(starts[sizes > _LARGE_BUCKET], ends[sizes > _LARGE_BUCKET])]
+    small = np.repeat(sizes <= _LARGE_BUCKET, sizes)
+    pairs = []
+    for offset in range(1, min(_LARGE_BUCKET, int(sizes.max(initial=1)))):
+        same = np.flatnonzero((sorted_keys[offset:] == sorted_keys[:-offset]) & small[offset:])
+        if not len(same):
+            break
+        first, second = order[same], order[same + offset]
+        pairs.append(np.stack((np.minimum(first, second), np.maximum(first, second)), axis=1))
+    return pairs, large
+
+
+# Function to return the (i, j) pairs, i < j, with cosine similarity of at least `threshold`. Candidates are the
+# vectors sharing a random-hyperplane signature in some band; each band's candidate pairs are scored right away in
+# batches of row-wise dot products, and the rare large buckets with blocked matrix products.
+def similar_pairs(vectors, threshold, recall=0.95, seed=0):
+    count, dim = vectors.shape
+    if count < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    bands, bits = lsh_params(threshold, count, recall)
+    rng = np.random.default_rng(seed)
+    weights = (1 << np.arange(bits)).astype(np.int64)
+    # Questions share n-grams such as "what is" and "how does"; hyperplanes through the mean keep them from piling
+    # up in a few buckets. Candidates are still scored on the original vectors.
+    mean = vectors.mean(axis=0)
+    pairs = []
+    for _ in range(bands):
+        planes = rng.standard_normal((dim, bits)).astype(np.float32)
+        signs = (vectors @ planes) > mean @ planes
+        candidates, large = _bucket_pairs(signs.astype(np.int64) @ weights)
+        for band_pairs in candidates:
+            for start in range(0, len(band_pairs), _PAIR_BATCH):
+                left, right = band_pairs[start:start + _PAIR_BATCH].T
+                similar = np.einsum('ij,ij->i', vectors[left], vectors[right]) >= threshold
+                pairs.append(np.stack((left[similar], right[similar]), axis=1))
+        for members in large:
+            block = max(1, _BLOCK_CELLS // len(members))
+            for row in range(0, len(members), block):
+                i, j = np.nonzero(vectors[members[row:row + block]] @ vectors[members].T >= threshold)
+                upper = i + row < j
+                pairs.append(np.stack((members[i[upper] + row], members[j[upper]]), axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    # The same pair is found again in every band it shares
+    keys = np.unique(np.concatenate(pairs) @ np.array([count, 1]))
+    return np.stack((keys // count, keys % count), axis=1)
+
+
+# Function to pick the items to keep among near-duplicates. Nodes are visited from the highest score down and a
+# node is kept unless it is similar to a node kept before it, so every dropped node is within the threshold of a
+# better kept one; chains of pairwise similar questions are not merged into one cluster. Returns, for every node,
+# the kept node that represents it (itself when kept).
+def best_first(scores, pairs):
+    count = len(scores)
+    keeper = np.arange(count)
+    if not len(pairs):
+        return keeper
+    edges = np.concatenate((pairs, pairs[:, ::-1]))
+    edges = edges[np.argsort(edges[:, 0], kind='stable')]
+    pointers = np.searchsorted(edges[:, 0], np.arange(count + 1))
+    neighbours = edges[:, 1]
+    degrees = np.diff(pointers)
+    # Nodes without a similar node are kept without visiting them
+    kept = degrees == 0
+    order = np.lexsort((np.arange(count), -scores))
+    for node in order[degrees[order] > 0].tolist():
+        adjacent = neighbours[pointers[node]:pointers[node + 1]]
+        better = adjacent[kept[adjacent]]
+        if len(better):
+            keeper[node] = better[np.argmax(scores[better])]
+        else:
+            kept[node] = True
+    return keeper
+
+
+def words(text):
+    return [word for word in _WORD_PATTERN.findall(text.lower()) if word not in _STOPWORDS]
+
+
+# Items of a chunk are written next to each other, so the same reference is looked up many times in a row
+@lru_cache(maxsize=256)
+def _reference_terms(reference):
+    return frozenset(words(reference)), reference.lower()
+
+
+def key_terms(answer):
+    return {term.lower() for term in _IDENTIFIER_PATTERN.findall(answer)
+            if '_' in term.strip('_') or '::' in term or term.startswith('-') or _CAMEL_PATTERN.search(term)}
+
+
+# Function to score how well an answer is supported: the fraction of its words and of its key terms (identifiers,
+# options, API names) found in the reference. Both are 1 without a reference (process_data.py output has none).
+def support(answer, reference):
+    if not reference:
+        return 1.0, 1.0
+    reference_words, reference_text = _reference_terms(reference)
+    answer_words = words(answer)
+    overlap = sum(word in reference_words for word in answer_words) / len(answer_words) if answer_words else 0.0
+    terms = key_terms(answer)
+    covered = sum(term in reference_text for term in terms) / len(terms) if terms else 1.0
+    return overlap, covered
+
+
+def _text(value):
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False) if value is not None else ''
+
+
+# Post-generation filter for QA datasets. Records whose answer mentions too few of its key terms in the reference
+# are dropped as unsupported; the remaining questions are grouped into near-duplicate clusters (cosine similarity of
+# character n-gram vectors of at least `threshold`), and of every cluster only the best-supported item is kept:
+# the highest reference word overlap weighted by the log of the answer length. Records without a `query` (script
+# datasets) are passed through.
+class QAFilter:
+    def __init__(self, threshold=0.9, min_key_terms=0.5, dim=256, ngram=3, recall=0.95, seed=0):
+        self.threshold = threshold
+        self.min_key_terms = min_key_terms
+        self.dim = dim
+        self.ngram = ngram
+        self.recall = recall
+        self.seed = seed
+        self.stats = Counter()
+
+    # Function to decide which rows of `reader` to keep; returns the kept rows in dataset order and, for the
+    # dropped ones, {row: (reason, kept row or None)}
+    def select(self, reader, references=None):
+        candidates, questions, scores = [], [], []
+        passed, dropped = [], {}
+        for row in range(len(reader)):
+            record = reader[row]
+            query = record.get('query')
+            if not isinstance(query, str):
+                passed.append(row)
+                continue
+            reference = record.get('reference')
+            if reference is None and references is not None and record.get('reference_id') in references:
+                reference = references.get(record['reference_id'])
+            answer = _text(record.get('answer'))
+            overlap, covered = support(answer, reference)
+            if covered < self.min_key_terms:
+                dropped[row] = ('unsupported', None)
+                continue
+            candidates.append(row)
+            questions.append(normalize(query))
+            scores.append(overlap * math.log1p(len(answer.split())))
+        self.stats.update(records=len(reader), passed_through=len(passed), unsupported=len(dropped))
+
+        # Identical normalized questions are collapsed before hashing, so a question asked a thousand times is
+        # compared once
+        unique = {}
+        question_ids = np.fromiter((unique.setdefault(question, len(unique)) for question in questions),
+                                   dtype=np.int64, count=len(questions))
+        vectors = char_ngram_vectors(list(unique), self.dim, self.ngram)
+        pairs = similar_pairs(vectors, self.threshold, self.recall, self.seed)
+
+        # Every question is represented by its best-scoring record; ties keep the earlier record
+        scores = np.asarray(scores, dtype=np.float64)
+        order = np.lexsort((np.arange(len(scores)), -scores, question_ids))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = question_ids[order][1:] != question_ids[order][:-1]
+        best = np.empty(len(unique), dtype=np.int64)
+        best[question_ids[order][first]] = order[first]
+        keeper = best[best_first(scores[best], pairs)][question_ids]
+        kept = []
+        for index, (row, kept_index) in enumerate(zip(candidates, keeper.tolist())):
+            if kept_index == index:
+                kept.append(row)
+            else:
+                dropped[row] = ('near_duplicate', candidates[kept_index])
+        self.stats.update(near_duplicate=len(candidates) - len(kept), kept=len(kept) + len(passed),
+                          similar_pairs=len(pairs))
+        return sorted(kept + passed), dropped
+
+    # Function to filter the dataset at `path` into `output_path`. Compact datasets (`reference_id`) read their
+    # references from `chunks_path`, by default the `<name>_chunks.jsonl` next to the dataset; `dropped_path`
+    # receives every dropped record with the reason and, for duplicates, the question that was kept instead.
+    def run(self, path, output_path, chunks_path=None, dropped_path=None):
+        chunks_path = chunks_path or reference_store.chunks_path_for(path)
+        references = reference_store.ReferenceReader(chunks_path) if os.path.exists(chunks_path) else None
+        try:
+            with dataset_index.DatasetReader(path) as reader:
+                kept, dropped = self.select(reader, references)
+                with dataset_writer.DatasetWriter(output_path, append=False, durability='none') as writer:
+                    for row in kept:
+                        writer.write(reader[row])
+                if dropped_path:
+                    with dataset_writer.DatasetWriter(dropped_path, append=False, durability='none') as writer:
+                        for row in sorted(dropped):
+                            reason, kept_row = dropped[row]
+                            writer.write({"reason": reason,
+                                          "duplicate_of": reader[kept_row]['query'] if kept_row is not None else None,
+                                          "record": reader[row]})
+        finally:
+            if references is not None:
+                references.close()
+        return dict(self.stats)
+
+    def report(self):
+        logging.info(f"QA filter (threshold {self.threshold}, key terms >= {self.min_key_terms:.0%}): kept "
+                     f"{self.stats['kept']} of {self.stats['records']} records; dropped "
+                     f"{self.stats['near_duplicate']} near-duplicates and {self.stats['unsupported']} answers whose "
+                     f"key terms are not in the reference")
+
+
+def default_output_path(path):
+    stem, ext = os.path.splitext(path)
+    return f'{stem}_filtered{ext}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drop near-duplicate questions and unsupported answers from a '
+                                                 'qa_generation.py or process_data.py dataset')
+    parser.add_argument('dataset', help='Dataset JSONL with query/answer records')
+    parser.add_argument('--output', default=None, help='Filtered dataset (default: <dataset>_filtered.jsonl)')
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help='Cosine similarity of character n-gram vectors above which questions are duplicates')
+    parser.add_argument('--min-key-terms', type=float, default=0.5,
+                        help='Minimum fraction of the identifiers of an answer that must appear in its reference')
+    parser.add_argument('--chunks', default=None, help='Chunks file of a compact dataset '
+                                                       '(default: <dataset>_chunks.jsonl)')
+    parser.add_argument('--dropped', default=None, help='Also write the dropped records with the reason to this file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    qa_filter = QAFilter(threshold=args.threshold, min_key_terms=args.min_key_terms)
+    qa_filter.run(args.dataset, args.output or default_output_path(args.dataset), args.chunks, args.dropped)
+    qa_filter.report()
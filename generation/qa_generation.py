@@ -1,11 +1,13 @@
-import json
-import random
-import re
 import os
-from tqdm import tqdm
+from collections import Counter
 
+import async_engine
+import batch_api
+import json_salvage
 import load_data
+import manifest
 import openai_api
+import pipeline
 import logging
 
 # Set up paths and logging configuration
@@ -13,66 +15,101 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 
-# Function to extract JSON from a block wrapped in ```json```
-def extract_json_content(content):
-    json_block_pattern = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
-    match = json_block_pattern.search(content)
-    if match:
-        return match.group(1)
-    else:
-        raise ValueError("No JSON block found in the content")
+# Function to tag parsed QA items with the chunk they were generated from
+def annotate_items(chunk, json_result):
+    for item in json_result:
+        item['reference'] = load_data.item_reference(chunk, item)
+        item['source'] = chunk.metadata["source"]
+    return json_result
 
 
-# Function to save a dictionary to a JSONL file
-def save_to_jsonl(data, output_path):
-    try:
-        with open(f'{output_path}/qa_dataset_rf_example.jsonl', 'a', encoding='utf-8') as file:
-            json.dump(data, file, ensure_ascii=False)
-            file.write("\n")  # Ensure each entry is on a new line
-    except Exception as e:
-        logging.error(f"Failed to save data to JSONL file: {e}")
+# Function to generate the QA items for a single chunk, each tagged with the chunk it came from
+async def process_chunk(chunk):
+    sys = openai_api.system_prompt('qa', chunk.metadata["source"])
+    json_result = await pipeline.async_get_api_response_with_retry(sys, chunk.page_content, 'qa')
+    if not json_result:
+        logging.warning("No valid JSON result returned after retries, skipping this chunk.")
+        return None
+    return annotate_items(chunk, json_result)
+
 
+# Function to write one Batch API request per chunk instead of calling the API
+def batch_export(chunks, batch_dir):
+    exporter = batch_api.BatchExporter(batch_dir, 'qa', openai_api.CONFIG["model"])
+    for chunk in chunks:
+        sys = openai_api.system_prompt('qa', chunk.metadata["source"])
+        exporter.add(f"qa-{chunk.metadata['chunk_id']}", sys, chunk.page_content, batch_api.chunk_to_meta(chunk))
+    exporter.close()
 
-# Function to make an API call with retry logic
-def get_api_response_with_retry(prompt, chunk, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
+
+# Function to parse downloaded Batch API results and write them like an interactive run would.
+# Chunks already in the manifest are skipped, so ingesting the same results twice adds nothing.
+def batch_ingest(batch_dir, write_items, run_manifest):
+    meta = batch_api.load_meta(batch_dir, 'qa')
+    stats = Counter()
+    for custom_id, response, error in batch_api.read_results(batch_dir):
+        if custom_id not in meta:
+            logging.warning(f"Unknown custom_id {custom_id} in batch results, skipping")
+            stats["unknown"] += 1
+            continue
+        chunk = batch_api.meta_to_chunk(meta[custom_id])
+        if run_manifest.is_done(chunk.metadata['chunk_id']):
+            stats["already_done"] += 1
+            continue
+        if error is not None:
+            logging.warning(f"Batch request {custom_id} failed: {error}")
+            stats["failed"] += 1
+            continue
         try:
-            response = openai_api.chat_gpt_api(prompt, chunk)
-            print(response)
-            json_data = extract_json_content(response)
-            return json.loads(json_data)  # Return parsed JSON
-        except ValueError as ve:
-            logging.warning(f"ValueError encountered: {ve}. Retrying...")
-        except json.JSONDecodeError as je:
-            logging.warning(f"JSONDecodeError encountered: {je}. Retrying...")
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}. Retrying...")
-        retry_count += 1
-    return None  # Return None if max retries are exhausted
+            json_result = json_salvage.parse(response, 'qa')
+        except ValueError as e:
+            logging.warning(f"Could not parse batch result {custom_id}: {e}")
+            stats["unparsable"] += 1
+            continue
+        write_items(chunk, annotate_items(chunk, json_result))
+        stats["ingested"] += 1
+    logging.info(f"Batch ingest: {dict(stats)}; chunks without a result are retried by the next run with --resume")
 
 
 if __name__ == '__main__':
-    DATA_PATH = '../data'
-    OUTPUT_PATH = './qa_dataset'
+    args = pipeline.parse_args('Generate QA pairs from EDA tool documentation',
+                               '../data', './qa_dataset')
+    OUTPUT_PATH = args.output_path
     os.makedirs(OUTPUT_PATH, exist_ok=True)
+    append = pipeline.appends(args)
+    run_manifest = manifest.RunManifest(f'{OUTPUT_PATH}/qa_manifest.jsonl', resume=append)
     # Load and split dataset into chunks
-    dataset = load_data.load_dataset(DATA_PATH)
-
-    chunk_data = load_data.split_docs(dataset)
-    random.shuffle(chunk_data)
-    # Main loop to process each chunk of data
-    sys_prompt = openai_api.cums_sys_prompt['qa']
-    for chunk in tqdm(chunk_data):
-        sys = openai_api.cums_sys_prompt['qa'].replace('{}', chunk.metadata["source"])
-        json_result = get_api_response_with_retry(sys, chunk.page_content)
-
-        # If we got a valid response, process the result
-        if json_result:
-            for item in json_result:
-                num += len(json_result)
-                item['reference'] = chunk.page_content
-                item['source'] = chunk.metadata["source"]
-                save_to_jsonl(item, OUTPUT_PATH)
+    chunk_source = pipeline.ChunkSource(args, run_manifest, openai_api.cums_sys_prompt['qa'],
+                                        load=args.batch != 'ingest')
+
+    writer = pipeline.open_writer(args, 'qa_dataset_rf_example.jsonl', append)
+    references = pipeline.open_reference_store(args, 'qa_dataset_rf_example.jsonl', append)
+
+    # Results are written as soon as each chunk completes; the chunk is only marked done once they are flushed
+    def write_items(chunk, items):
+        def done():
+            run_manifest.mark_done(chunk, len(items))
+            chunk_source.mark_generated(chunk)
+
+        if references:
+            items = [references.normalize(item) for item in items]
+        writer.write_many(items, callback=done)
+
+    try:
+        if args.batch == 'export':
+            batch_export(chunk_source.chunks, args.batch_dir)
+        elif args.batch == 'ingest':
+            batch_ingest(args.batch_dir, write_items, run_manifest)
         else:
-            logging.warning("No valid JSON result returned after retries, skipping this chunk.")
+            async_engine.run(chunk_source.chunks, process_chunk, write_items, concurrency=args.concurrency,
+                             desc='Generating QA pairs', queue_size=args.queue_size if args.stream else None)
+    finally:
+        # Results already generated are flushed and recorded even if the run stops on an error
+        writer.close()
+        if references:
+            references.close()
+        run_manifest.close()
+        chunk_source.close()
+        openai_api.cache.log_stats()
+        json_salvage.log_stats()
+        pipeline.write_metrics(args, 'qa')
@@ -0,0 +1,100 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+
+import dataset_writer
+
+
+def reference_id(reference: str) -> str:
+    return hashlib.sha256(reference.encode('utf-8')).hexdigest()[:20]
+
+
+# Compact output format: every reference text is stored once in a chunks file keyed by its content hash,
+# and dataset records carry only `reference_id`. References are flushed as soon as they are first seen,
+# so a record on disk never points at a reference that is not.
+class ReferenceStore:
+    def __init__(self, path, durability='flush', append=True):
+        self.path = path
+        self.seen = set()
+        if append and os.path.exists(path):
+            with open(path, 'rb') as file:
+                for line in file:
+                    try:
+                        self.seen.add(json.loads(line)['reference_id'])
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+        self._writer = dataset_writer.DatasetWriter(path, batch_size=1, durability=durability, append=append)
+
+    # Function to replace an item's `reference` with its `reference_id`, storing the text on first sight
+    def normalize(self, item):
+        if 'reference' not in item:
+            return item
+        reference = item['reference']
+        ref_id = reference_id(reference)
+        if ref_id not in self.seen:
+            self.seen.add(ref_id)
+            self._writer.write({"reference_id": ref_id, "reference": reference})
+        return {('reference_id' if key == 'reference' else key): (ref_id if key == 'reference' else value)
+                for key, value in item.items()}
+
+    def close(self):
+        self._writer.close()
+
+
+# Random access to a chunks file: only byte offsets are kept in memory and texts are decoded on demand
+class ReferenceReader:
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+        self._offsets = {}
+        position = 0
+        for line in iter(self._map.readline, b'') if self._map else ():
+            record = json.loads(line)
+            self._offsets[record['reference_id']] = (position, len(line))
+            position += len(line)
+
+    def __contains__(self, ref_id):
+        return ref_id in self._offsets
+
+    def get(self, ref_id):
+        start, length = self._offsets[ref_id]
+        return json.loads(self._map[start:start + length])['reference']
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+# Function to rebuild the full denormalized records, putting `reference` back where `reference_id` was
+def rehydrate(records_path, chunks_path):
+    reader = ReferenceReader(chunks_path)
+    try:
+        with open(records_path, 'rb') as file:
+            for line in file:
+                item = json.loads(line)
+                if 'reference_id' in item:
+                    item = {('reference' if key == 'reference_id' else key):
+                            (reader.get(value) if key == 'reference_id' else value) for key, value in item.items()}
+                yield item
+    finally:
+        reader.close()
+
+
+def chunks_path_for(dataset_path):
+    stem, ext = os.path.splitext(dataset_path)
+    return f'{stem}_chunks{ext}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rehydrate a compact dataset into full records with references')
+    parser.add_argument('records', help='Compact dataset JSONL with reference_id fields')
+    parser.add_argument('output', help='Output JSONL with full reference texts')
+    parser.add_argument('--chunks', default=None, help='Chunks file (default: <records>_chunks.jsonl)')
+    args = parser.parse_args()
+
+    with dataset_writer.DatasetWriter(args.output, append=False) as writer:
+        for record in rehydrate(args.records, args.chunks or chunks_path_for(args.records)):
+            writer.write(record)
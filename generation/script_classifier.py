@@ -0,0 +1,92 @@
+import logging
+import re
+from collections import Counter
+
+# Lexical evidence that a chunk contains Tcl/Python script usage, with its weight
+FEATURES = {
+    # ```tcl / ```python / bare fenced blocks
+    "code_fence": (re.compile(r'^\s*```', re.MULTILINE), 2.0),
+    # Python APIs of the supported tools
+    "python_import": (re.compile(r'^\s*(?:import|from)\s+(?:openroad|odb|pya|klayout|amaranth|pyverilog)\b',
+                                 re.MULTILINE), 8.0),
+    # A snake_case command at the start of a line followed by arguments, e.g. `set_clock -name clk`
+    "tcl_command": (re.compile(r'^\s*[a-z][a-z0-9]*(?:_[a-z0-9]+)+\s+(?:-|\[|<|\$|\w)', re.MULTILINE), 1.0),
+    # Common Tcl built-ins and yosys/OpenROAD flow commands
+    "tcl_builtin": (re.compile(r'^\s*(?:set|proc|source|foreach|puts|read_verilog|read_liberty|read_lef|read_def|'
+                               r'read_db|write_db|link_design|synth|opt|abc|stat|create_clock|report_checks)\b\s+\S',
+                               re.MULTILINE), 1.5),
+    # `-flag <value>` / `-flag value` and synopsis style `[-flag value]`
+    "flag_value": (re.compile(r'(?:^|\s|\[)-[a-z][a-z0-9_]*\s+(?:<[^>\n]+>|\$?\w[\w.]*)', re.MULTILINE), 0.5),
+    "flag_option": (re.compile(r'\[-[a-z][a-z0-9_]*'), 1.0),
+    # Namespaced commands such as gui::zoom_out
+    "namespace_command": (re.compile(r'\b[a-z]+::[a-z_]+\b'), 1.0),
+    # Man-page sections used by the tool docs
+    "synopsis": (re.compile(r'^\s*(?:SYNOPSIS|Synopsis|Usage|USAGE|Example usage|EXAMPLES?)\s*:?\s*$', re.MULTILINE), 2.0),
+    # Shell prompts with tool invocations
+    "shell_prompt": (re.compile(r'^\s*(?:\$|%|>>>|openroad>|yosys>)\s+\S', re.MULTILINE), 1.5),
+}
+
+# Scores at or below NEGATIVE_THRESHOLD skip both LLM calls, scores at or above POSITIVE_THRESHOLD go straight
+# to extraction, everything in between is sent to the script_judge prompt
+NEGATIVE_THRESHOLD = 1.0
+POSITIVE_THRESHOLD = 8.0
+
+
+def features(text):
+    return {name: len(pattern.findall(text)) for name, (pattern, _) in FEATURES.items()}
+
+
+# Each feature contributes at most three matches so one long flag table does not dominate the score
+def score(text):
+    return sum(min(count, 3) * FEATURES[name][1] for name, count in features(text).items())
+
+
+def classify(text, negative_threshold=NEGATIVE_THRESHOLD, positive_threshold=POSITIVE_THRESHOLD):
+    value = score(text)
+    if value <= negative_threshold:
+        return 'negative'
+    if value >= positive_threshold:
+        return 'positive'
+    return 'ambiguous'
+
+
+# Function to compare classifier decisions with script_judge labels (True = script found).
+# Precision/recall are reported for the shortcuts the classifier takes: "positive" skips the judge and
+# "negative" skips both calls, so a false negative is a lost script and a false positive a wasted extraction.
+def evaluate(decisions, judge_labels):
+    counts = Counter(zip(decisions, judge_labels))
+    positives = sum(1 for label in judge_labels if label)
+    negatives = len(judge_labels) - positives
+    tp, fp = counts[('positive', True)], counts[('positive', False)]
+    tn, fn = counts[('negative', False)], counts[('negative', True)]
+    ambiguous = counts[('ambiguous', True)] + counts[('ambiguous', False)]
+    total = len(judge_labels)
+    # Without the classifier every chunk is judged and every positive extracted; with it, positives are only
+    # extracted, negatives cost nothing and ambiguous chunks cost the judge plus extraction when it says yes
+    calls_without = 2 * positives + negatives
+    calls_with = tp + fp + ambiguous + counts[('ambiguous', True)]
+    return {
+        "chunks": total,
+        "judge_positive": positives,
+        "positive_precision": tp / (tp + fp) if tp + fp else None,
+        "positive_recall": tp / positives if positives else None,
+        "negative_precision": tn / (tn + fn) if tn + fn else None,
+        "negative_recall": tn / negatives if negatives else None,
+        "missed_scripts": fn,
+        "ambiguous": ambiguous,
+        "llm_calls": calls_with,
+        "llm_calls_without_classifier": calls_without,
+    }
+
+
+def log_report(report):
+    def fmt(value):
+        return 'n/a' if value is None else f'{value:.1%}'
+
+    logging.info(
+        f"Script pre-classifier vs script_judge on {report['chunks']} chunks ({report['judge_positive']} with scripts): "
+        f"positive precision {fmt(report['positive_precision'])}, recall {fmt(report['positive_recall'])}; "
+        f"negative precision {fmt(report['negative_precision'])}, recall {fmt(report['negative_recall'])}; "
+        f"{report['missed_scripts']} scripts missed, {report['ambiguous']} chunks left to the judge; "
+        f"{report['llm_calls']} LLM calls instead of {report['llm_calls_without_classifier']}"
+    )
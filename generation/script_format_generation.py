@@ -1,12 +1,16 @@
-import json
 import os
-import random
-import re
-
-from tqdm import tqdm
+from collections import Counter
+from functools import partial
+from itertools import islice
 
+import async_engine
+import batch_api
+import json_salvage
 import load_data
+import manifest
 import openai_api
+import pipeline
+import script_classifier
 import logging
 
 # Set up paths and logging configuration
@@ -14,70 +18,204 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 
-# Function to extract JSON from a block wrapped in ```json```
-def extract_json_content(content):
-    json_block_pattern = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
-    match = json_block_pattern.search(content)
-    if match:
-        return match.group(1)
-    else:
-        raise ValueError("No JSON block found in the content")
+# Function to tag parsed script descriptions with the chunk they were extracted from
+def annotate_items(chunk, script_result):
+    for item in script_result:
+        item['reference'] = load_data.item_reference(chunk, item)  # Add the reference from the chunk
+        item['source'] = chunk.metadata["source"]
+    return script_result
 
 
-# Function to save a dictionary to a JSONL file
-def save_to_jsonl(data, output_path):
-    try:
-        with open(f'{output_path}/script_dataset_rf_example1.jsonl', 'a', encoding='utf-8') as file:
-            json.dump(data, file, ensure_ascii=False)
-            file.write("\n")  # Ensure each entry is on a new line
-    except Exception as e:
-        logging.error(f"Failed to save data to JSONL file: {e}")
+# Function to keep the script items of a script_fused result; `{"script_found": false}` leaves none
+def extracted_scripts(json_result):
+    return [item for item in json_result if "script_name" in item]
+
+
+# Decisions taken by the local pre-classifier during a run
+prefilter_decisions = Counter()
 
 
-# Function to make an API call with retry logic
-def get_api_response_with_retry(prompt, chunk, max_retries=3):
-    retry_count = 0
-    while retry_count < max_retries:
+# Function to judge a single chunk and, if it contains scripts, extract them tagged with the chunk.
+# With `prefilter` set to (negative threshold, positive threshold) the local classifier settles clear cases:
+# negatives skip both calls, positives skip the judge, and only ambiguous chunks are sent to script_judge.
+# With `fused` set, ambiguous chunks are judged and extracted by one script_fused call instead.
+async def process_chunk(chunk, prefilter=None, fused=False):
+    decision = 'ambiguous'
+    if prefilter:
+        decision = script_classifier.classify(chunk.page_content, *prefilter)
+        prefilter_decisions[decision] += 1
+        if decision == 'negative':
+            return []
+    if decision == 'ambiguous' and fused:
+        sys = openai_api.system_prompt('script_fused', chunk.metadata["source"])
+        json_result = await pipeline.async_get_api_response_with_retry(sys, chunk.page_content, 'script_fused')
+        if not json_result:
+            logging.warning("No valid JSON result returned after retries, skipping this chunk.")
+            return None
+        return annotate_items(chunk, extracted_scripts(json_result))
+    if decision == 'ambiguous':
+        sys = openai_api.system_prompt('script_judge', chunk.metadata["source"])
+        json_result = await pipeline.async_get_api_response_with_retry(sys, chunk.page_content, 'script_judge')
+        if not json_result:
+            return None
+        if not json_result.get("script_found"):
+            return []
+    sys_script = openai_api.system_prompt('script', chunk.metadata["source"])
+    script_result = await pipeline.async_get_api_response_with_retry(sys_script, chunk.page_content, 'script')
+    if not script_result:
+        logging.warning("No valid JSON result returned after retries, skipping this chunk.")
+        return None
+    return annotate_items(chunk, script_result)
+
+
+async def judge_chunk(chunk):
+    sys = openai_api.system_prompt('script_judge', chunk.metadata["source"])
+    json_result = await pipeline.async_get_api_response_with_retry(sys, chunk.page_content, 'script_judge')
+    return None if not json_result else [bool(json_result.get("script_found"))]
+
+
+# Function to run script_judge on a sample of chunks and report how the pre-classifier compares to it
+def calibrate(chunks, sample_size, prefilter, concurrency):
+    sample = list(islice(chunks, sample_size))
+    labels = {}
+    async_engine.run(sample, judge_chunk, lambda chunk, found: labels.__setitem__(chunk.metadata['chunk_id'], found[0]),
+                     concurrency=concurrency, desc='Judging calibration sample')
+    judged = [chunk for chunk in sample if chunk.metadata['chunk_id'] in labels]
+    decisions = [script_classifier.classify(chunk.page_content, *prefilter) for chunk in judged]
+    report = script_classifier.evaluate(decisions, [labels[chunk.metadata['chunk_id']] for chunk in judged])
+    script_classifier.log_report(report)
+    return report
+
+
+def add_arguments(parser):
+    parser.add_argument('--prefilter', action='store_true',
+                        help='Use the local script classifier to skip script_judge calls for clear cases')
+    parser.add_argument('--prefilter-negative', type=float, default=script_classifier.NEGATIVE_THRESHOLD,
+                        help='Classifier scores at or below this skip both LLM calls')
+    parser.add_argument('--prefilter-positive', type=float, default=script_classifier.POSITIVE_THRESHOLD,
+                        help='Classifier scores at or above this go straight to extraction')
+    parser.add_argument('--calibrate', type=int, default=None, metavar='N',
+                        help='Judge N chunks and report classifier precision/recall instead of generating')
+    parser.add_argument('--fused', action='store_true',
+                        help='Judge and extract with a single script_fused call per chunk instead of two calls')
+
+
+# Function to write the first Batch API stage: one script_judge request per chunk, or with `fused` one
+# script_fused request that needs no second stage
+def batch_export(chunks, batch_dir, fused=False):
+    stage, prompt = ('fused', 'script_fused') if fused else ('judge', 'script_judge')
+    exporter = batch_api.BatchExporter(batch_dir, 'script', openai_api.CONFIG["model"])
+    for chunk in chunks:
+        sys = openai_api.system_prompt(prompt, chunk.metadata["source"])
+        exporter.add(f"{stage}-{chunk.metadata['chunk_id']}", sys, chunk.page_content, batch_api.chunk_to_meta(chunk))
+    exporter.close()
+
+
+# json_salvage schema of the results of each Batch API stage
+BATCH_SCHEMAS = {'judge': 'script_judge', 'script': 'script', 'fused': 'script_fused'}
+
+
+# Function to ingest downloaded Batch API results for both stages. Judge results that found scripts are
+# exported as `script_extract_requests_*.jsonl` for the second stage; extraction and script_fused results are
+# written to the dataset. Chunks already in the manifest are skipped, so re-ingesting after the second stage is safe.
+def batch_ingest(batch_dir, write_items, run_manifest):
+    meta = batch_api.load_meta(batch_dir, 'script')
+    results = {}
+    for custom_id, response, error in batch_api.read_results(batch_dir):
+        results[custom_id] = (response, error)
+
+    stats = Counter()
+    exporter = batch_api.BatchExporter(batch_dir, 'script_extract', openai_api.CONFIG["model"])
+    for custom_id, (response, error) in results.items():
+        stage, chunk_id = custom_id.split('-', 1)
+        # Chunk metadata is stored once, under the custom_id of the first stage's request
+        first_stage = next((key for key in (f"judge-{chunk_id}", f"fused-{chunk_id}") if key in meta), None)
+        if first_stage is None:
+            logging.warning(f"Unknown custom_id {custom_id} in batch results, skipping")
+            stats["unknown"] += 1
+            continue
+        chunk = batch_api.meta_to_chunk(meta[first_stage])
+        if run_manifest.is_done(chunk_id):
+            stats["already_done"] += 1
+            continue
+        if error is not None:
+            logging.warning(f"Batch request {custom_id} failed: {error}")
+            stats["failed"] += 1
+            continue
         try:
-            response = openai_api.chat_gpt_api(prompt, chunk)
-            json_data = extract_json_content(response)
-            return json.loads(json_data)  # Return parsed JSON
-        except ValueError as ve:
-            logging.warning(f"ValueError encountered: {ve}. Retrying...")
-        except json.JSONDecodeError as je:
-            logging.warning(f"JSONDecodeError encountered: {je}. Retrying...")
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}. Retrying...")
-        retry_count += 1
-    return None  # Return None if max retries are exhausted
+            json_result = json_salvage.parse(response, BATCH_SCHEMAS[stage])
+        except ValueError as e:
+            logging.warning(f"Could not parse batch result {custom_id}: {e}")
+            stats["unparsable"] += 1
+            continue
+        if stage == 'judge':
+            if not json_result.get("script_found"):
+                write_items(chunk, [])
+                stats["no_script"] += 1
+            elif f"script-{chunk_id}" not in results:
+                sys_script = openai_api.system_prompt('script', chunk.metadata["source"])
+                exporter.add(f"script-{chunk_id}", sys_script, chunk.page_content)
+                stats["extract_exported"] += 1
+        elif stage == 'fused':
+            scripts = extracted_scripts(json_result)
+            write_items(chunk, annotate_items(chunk, scripts))
+            stats["ingested" if scripts else "no_script"] += 1
+        else:
+            write_items(chunk, annotate_items(chunk, json_result))
+            stats["ingested"] += 1
+    exporter.close()
+    logging.info(f"Batch ingest: {dict(stats)}; chunks without a result are retried by the next run with --resume")
 
 
 if __name__ == '__main__':
-    DATA_PATH = '../data/markdown/OpenROAD_flow_script_docs/general'
-    OUTPUT_PATH = './script_dataset'
+    args = pipeline.parse_args('Generate script descriptions from EDA tool documentation',
+                               '../data/markdown/OpenROAD_flow_script_docs/general', './script_dataset',
+                               add_arguments)
+    OUTPUT_PATH = args.output_path
     os.makedirs(OUTPUT_PATH, exist_ok=True)
+    # Calibration writes nothing, so it leaves an earlier run's output alone
+    append = pipeline.appends(args) or bool(args.calibrate)
+    run_manifest = manifest.RunManifest(f'{OUTPUT_PATH}/script_manifest.jsonl', resume=append)
     # Load and split dataset into chunks
-    dataset = load_data.load_dataset(DATA_PATH)
+    chunk_source = pipeline.ChunkSource(args, run_manifest,
+                                        openai_api.cums_sys_prompt['script_fused' if args.fused else 'script'],
+                                        load=args.batch != 'ingest')
 
-    chunk_data = load_data.split_docs(dataset)
-    random.shuffle(chunk_data)
+    writer = pipeline.open_writer(args, 'script_dataset_rf_example1.jsonl', append)
+    references = pipeline.open_reference_store(args, 'script_dataset_rf_example1.jsonl', append)
 
-    # Main loop to process each chunk of data
+    # Results are written as soon as each chunk completes; the chunk is only marked done once they are flushed
+    def write_items(chunk, items):
+        def done():
+            run_manifest.mark_done(chunk, len(items))
+            chunk_source.mark_generated(chunk)
 
-    for chunk in tqdm(chunk_data):
-        sys = openai_api.cums_sys_prompt['script_judge'].replace('{}', chunk.metadata["source"])
-        json_result = get_api_response_with_retry(sys, chunk.page_content)
+        if references:
+            items = [references.normalize(item) for item in items]
+        writer.write_many(items, callback=done)
 
-        if not json_result["script_found"]:
-            continue
-        sys_script = openai_api.cums_sys_prompt['script'].replace('{}', chunk.metadata["source"])
-        script_result = get_api_response_with_retry(sys_script, chunk.page_content)
-        # If we got a valid response, process the result
-        if script_result:
-            for item in script_result:
-                item['reference'] = chunk.page_content # Add the reference from the chunk
-                item['source'] = chunk.metadata["source"]
-                save_to_jsonl(item, OUTPUT_PATH)
+    prefilter = (args.prefilter_negative, args.prefilter_positive)
+    try:
+        if args.calibrate:
+            calibrate(chunk_source.chunks, args.calibrate, prefilter, args.concurrency)
+        elif args.batch == 'export':
+            batch_export(chunk_source.chunks, args.batch_dir, args.fused)
+        elif args.batch == 'ingest':
+            batch_ingest(args.batch_dir, write_items, run_manifest)
         else:
-            logging.warning("No valid JSON result returned after retries, skipping this chunk.")
-
+            async_engine.run(chunk_source.chunks,
+                             partial(process_chunk, prefilter=prefilter if args.prefilter else None, fused=args.fused),
+                             write_items, concurrency=args.concurrency, desc='Generating script descriptions',
+                             queue_size=args.queue_size if args.stream else None)
+            if args.prefilter:
+                logging.info(f"Script pre-classifier decisions: {dict(prefilter_decisions)}")
+    finally:
+        # Results already generated are flushed and recorded even if the run stops on an error
+        writer.close()
+        if references:
+            references.close()
+        run_manifest.close()
+        chunk_source.close()
+        openai_api.cache.log_stats()
+        json_salvage.log_stats()
+        pipeline.write_metrics(args, 'script')
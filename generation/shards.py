@@ -0,0 +1,156 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import defaultdict
+
+import dataset_writer
+
+SHARD_DIR_PATTERN = re.compile(r'^shard-(\d+)-of-(\d+)$')
+# Rotated output files written by DatasetWriter: <name>-00000.jsonl, ...
+_ROTATED_PATTERN = re.compile(r'^(.*)-\d{5}(\.jsonl)$')
+# Fields that record where an item came from rather than what it says; duplicates may differ in them
+PROVENANCE_FIELDS = ('reference', 'reference_id')
+
+
+def shard_dir(index, count):
+    return f'shard-{index}-of-{count}'
+
+
+# Function to parse a `--shard I/N` value
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got {value!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count}), got {index}")
+    return index, count
+
+
+# Chunk IDs are content hashes of source and text, so every worker assigns every chunk to the same shard
+def in_shard(chunk, shard):
+    index, count = shard
+    return int(chunk.metadata['chunk_id'], 16) % count == index
+
+
+def item_key(record):
+    content = {key: value for key, value in record.items() if key not in PROVENANCE_FIELDS}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+# Identity of a line of each kind of shard file, for deduplication
+MERGE_KEYS = {
+    'records': item_key,
+    'chunks': lambda record: record.get('reference_id'),
+    'manifest': lambda record: record.get('chunk_id'),
+}
+
+
+# Function to find the shard directories under `output_path`, warning about missing or mixed shard counts
+def find_shards(output_path):
+    shards = {}
+    for path in sorted(glob.glob(os.path.join(output_path, 'shard-*-of-*'))):
+        match = SHARD_DIR_PATTERN.match(os.path.basename(path))
+        if match and os.path.isdir(path):
+            shards[(int(match.group(1)), int(match.group(2)))] = path
+    counts = {count for _, count in shards}
+    if len(counts) > 1:
+        raise ValueError(f"Shard directories of different runs in {output_path}: shard counts {sorted(counts)}")
+    for count in counts:
+        missing = [index for index in range(count) if (index, count) not in shards]
+        if missing:
+            logging.warning(f"Shards {missing} of {count} are missing; merging the other {len(shards)}")
+    return [shards[key] for key in sorted(shards)]
+
+
+# Function to group a shard's JSONL files by the dataset they belong to: {kind: {name: [paths]}}, where kind is
+# 'records', 'chunks' (references of --compact) or 'manifest'
+def shard_files(path):
+    files = defaultdict(lambda: defaultdict(list))
+    for file_path in sorted(glob.glob(os.path.join(path, '*.jsonl'))):
+        file_name = os.path.basename(file_path)
+        match = _ROTATED_PATTERN.match(file_name)
+        name = match.group(1) + match.group(2) if match else file_name
+        if name.endswith('_manifest.jsonl'):
+            kind = 'manifest'
+        elif name.endswith('_chunks.jsonl'):
+            kind = 'chunks'
+        else:
+            kind = 'records'
+        files[kind][name].append(file_path)
+    return files
+
+
+def read_jsonl(paths):
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line of a killed worker
+                    continue
+
+
+# Function to merge the shard outputs under `output_path` into its top-level datasets. Records are deduplicated
+# by content (ignoring their reference), references of --compact by reference_id and manifest entries by chunk_id,
+# so the merged manifest also lets a later unsharded `--resume` run skip everything the shards finished.
+def merge(output_path, durability='flush', force=False):
+    shard_paths = find_shards(output_path)
+    if not shard_paths:
+        raise ValueError(f"No shard-I-of-N directories in {output_path}")
+    per_shard = [shard_files(path) for path in shard_paths]
+    names = sorted({(kind, name) for files in per_shard for kind, file_names in files.items() for name in file_names})
+    existing = [name for _, name in names if os.path.exists(os.path.join(output_path, name))]
+    if existing and not force:
+        raise FileExistsError(f"{existing} already exist in {output_path}; pass --force to overwrite them")
+
+    stats = [{"shard": os.path.basename(path), "written": defaultdict(int), "duplicates": defaultdict(int)}
+             for path in shard_paths]
+    for kind, name in names:
+        seen = set()
+        with dataset_writer.DatasetWriter(os.path.join(output_path, name), append=False,
+                                          durability=durability) as writer:
+            for files, shard_stats in zip(per_shard, stats):
+                for record in read_jsonl(files[kind].get(name, [])):
+                    key = MERGE_KEYS[kind](record)
+                    if key in seen:
+                        shard_stats["duplicates"][name] += 1
+                        continue
+                    seen.add(key)
+                    writer.write(record)
+                    shard_stats["written"][name] += 1
+
+    for path, shard_stats in zip(shard_paths, stats):
+        shard_stats.update(written=dict(shard_stats["written"]), duplicates=dict(shard_stats["duplicates"]))
+        # Run reports written by metrics.run.write
+        for report_path in sorted(glob.glob(os.path.join(path, '*_run_report.json'))):
+            with open(report_path, 'r', encoding='utf-8') as file:
+                report = json.load(file)
+            shard_stats[os.path.basename(report_path)[:-len('_run_report.json')]] = {
+                "elapsed_seconds": report.get("elapsed_seconds"),
+                "requests": report.get("requests"),
+                "estimated_cost_usd": report.get("estimated_cost_usd"),
+            }
+    with open(os.path.join(output_path, 'merge_report.json'), 'w', encoding='utf-8') as file:
+        json.dump(stats, file, ensure_ascii=False, indent=2)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the outputs of a --shard I/N run into the final datasets')
+    parser.add_argument('output_path', help='The --output-path the shards were run with')
+    parser.add_argument('--durability', choices=dataset_writer.DURABILITY, default='flush')
+    parser.add_argument('--force', action='store_true', help='Overwrite merged datasets that already exist')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    for shard_stats in merge(args.output_path, args.durability, args.force):
+        written = ', '.join(f"{name}: {count}" for name, count in shard_stats["written"].items())
+        duplicates = sum(shard_stats["duplicates"].values())
+        logging.info(f"{shard_stats['shard']}: {written or 'nothing'}; {duplicates} duplicates dropped")
+    logging.info(f"Merge report written to {os.path.join(args.output_path, 'merge_report.json')}")
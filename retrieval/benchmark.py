@@ -0,0 +1,109 @@
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+import bm25_index
+import vector_index
+
+DEFAULT_DATASETS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'generation', 'dataset', name)
+    for name in ('qa_dataset_rf_example.jsonl', 'script_dataset_rf_example.jsonl')
+]
+
+
+# Function to write `scale` copies of the datasets into one file, so the example data can stand in for a large
+# corpus; copies get a suffix on every string so they do not collapse onto the same postings
+def replicate(datasets, scale, path):
+    with open(path, 'w', encoding='utf-8') as output:
+        for copy in range(scale):
+            for dataset in datasets:
+                with open(dataset, 'r', encoding='utf-8') as file:
+                    for line in file:
+                        record = json.loads(line)
+                        if copy:
+                            record = {key: f'{value} v{copy}' if isinstance(value, str) else value
+                                      for key, value in record.items()}
+                        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return [path]
+
+
+def sample_queries(datasets, count, seed):
+    queries = []
+    for dataset in datasets:
+        with open(dataset, 'r', encoding='utf-8') as file:
+            for line in file:
+                record = json.loads(line)
+                examples = record.get('examples') or [{}]
+                queries.append(record.get('query') or examples[0].get('query') or record.get('script_name') or '')
+    rng = random.Random(seed)
+    return [rng.choice(queries) for _ in range(count)]
+
+
+def time_search(search, queries, batch_size):
+    latencies = []
+    start = time.perf_counter()
+    for offset in range(0, len(queries), batch_size):
+        batch_start = time.perf_counter()
+        search(queries[offset:offset + batch_size])
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+    latencies = np.asarray(latencies) * 1000
+    return {"batch_size": batch_size, "qps": len(queries) / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+
+# Function to time building an index, loading it back from disk and searching it at each batch size
+def run(name, build, load, queries, batch_sizes, k):
+    start = time.perf_counter()
+    build()
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    index = load()
+    load_time = time.perf_counter() - start
+    logging.info(f"{name}: {len(index)} records, build {build_time:.2f}s, mmap load {load_time * 1000:.1f}ms")
+    results = []
+    for batch_size in batch_sizes:
+        stats = time_search(lambda batch: index.search(batch, k=k), queries, batch_size)
+        logging.info(f"  batch {batch_size:>4}: {stats['qps']:.0f} queries/s, "
+                     f"p50 {stats['p50_ms']:.2f}ms, p99 {stats['p99_ms']:.2f}ms per batch")
+        results.append(stats)
+    index.close()
+    return {"index": name, "records": len(index), "build_s": build_time, "load_ms": load_time * 1000,
+            "search": results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure retrieval index build time, load time and query latency')
+    parser.add_argument('datasets', nargs='*', default=DEFAULT_DATASETS)
+    parser.add_argument('--scale', type=int, default=1, help='Replicate the datasets this many times')
+    parser.add_argument('--queries', type=int, default=1024)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 128])
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        datasets = args.datasets
+        if args.scale > 1:
+            datasets = replicate(datasets, args.scale, os.path.join(work_dir, 'corpus.jsonl'))
+        queries = sample_queries(datasets, args.queries, args.seed)
+        bm25_dir, vector_dir, int8_dir = (os.path.join(work_dir, name) for name in ('bm25', 'vectors', 'int8'))
+        report = [
+            run('bm25', lambda: bm25_index.BM25Index.build(datasets).save(bm25_dir),
+                lambda: bm25_index.BM25Index.load(bm25_dir), queries, args.batch_sizes, args.k),
+            run('vector float32', lambda: vector_index.VectorIndex(vector_dir).update(datasets),
+                lambda: vector_index.VectorIndex(vector_dir), queries, args.batch_sizes, args.k),
+            run('vector int8', lambda: vector_index.VectorIndex(int8_dir, quantized=True).update(datasets),
+                lambda: vector_index.VectorIndex(int8_dir), queries, args.batch_sizes, args.k),
+        ]
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+# Generated datasets are read through the offset index that lives next to the generation scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'generation'))
+import dataset_index
+
+# Record fields that are indexed. Script records keep their query/answer pairs in `examples`; nested values are
+# flattened into text.
+DEFAULT_FIELDS = ('query', 'answer', 'script_name', 'script_paradigm', 'examples')
+
+# Identifiers such as `set_clock`, `-max_paths`, `gui::zoom_out`, `findInst` or `sky130hd`, and plain numbers
+_TOKEN_PATTERN = re.compile(r'-?[A-Za-z_][\w]*(?:::[A-Za-z_]\w*)*|\d+(?:\.\d+)?')
+_CAMEL_PATTERN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+_SPLIT_PATTERN = re.compile(r'_+|::')
+_STOPWORDS = frozenset(
+    'a an and are as at be by can do does for from how i in is it of on or that the this to what when which '
+    'with you your'.split()
+)
+# Postings scored per query block stay below this many (query, document) cells
+_BLOCK_CELLS = 1 << 22
+
+
+# Function to map one token to its terms. A compound identifier is kept whole and also split into its parts, so
+# `set_clock_uncertainty` matches both the exact command and a query for "clock uncertainty", and `-flag` matches
+# with or without its dash. Vocabularies are small, so results are cached per token.
+@lru_cache(maxsize=1 << 18)
+def _token_terms(token):
+    lower = token.lower()
+    terms = [] if lower in _STOPWORDS else [lower]
+    bare = lower.lstrip('-')
+    if bare != lower:
+        terms.append(bare)
+    parts = [part.lower() for piece in _SPLIT_PATTERN.split(token.lstrip('-'))
+             for part in _CAMEL_PATTERN.findall(piece)]
+    if len(parts) > 1:
+        terms.extend(part for part in parts if part not in _STOPWORDS)
+    return terms
+
+
+def tokenize(text):
+    return [term for token in _TOKEN_PATTERN.findall(text) for term in _token_terms(token)]
+
+
+def _field_text(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return ' '.join(_field_text(item) for item in value.values())
+    if isinstance(value, list):
+        return ' '.join(_field_text(item) for item in value)
+    return '' if value is None else str(value)
+
+
+def record_text(record, fields=DEFAULT_FIELDS):
+    return ' '.join(_field_text(record.get(field)) for field in fields)
+
+
+# Okapi BM25 over generated datasets, stored as a CSR inverted index: for term t, `docs[indptr[t]:indptr[t + 1]]`
+# are the documents containing it and `weights[...]` their precomputed BM25 term weights (idf included), so a
+# query is a sum of posting slices. Documents are (dataset, row) pairs resolved through dataset_index.
+class BM25Index:
+    def __init__(self, vocab, indptr, docs, weights, doc_file, doc_row, meta):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.docs = docs
+        self.weights = weights
+        self.doc_file = doc_file
+        self.doc_row = doc_row
+        self.meta = meta
+        self._readers = {}
+
+    def __len__(self):
+        return len(self.doc_row)
+
+    @classmethod
+    def build(cls, datasets, fields=DEFAULT_FIELDS, k1=1.2, b=0.75):
+        vocab = {}
+        term_ids, doc_ids, counts, lengths, doc_file, doc_row = [], [], [], [], [], []
+        for file_index, path in enumerate(datasets):
+            with dataset_index.DatasetReader(path) as reader:
+                for row in range(len(reader)):
+                    terms = Counter(tokenize(record_text(reader[row], fields)))
+                    doc = len(lengths)
+                    for term, count in terms.items():
+                        term_ids.append(vocab.setdefault(term, len(vocab)))
+                        doc_ids.append(doc)
+                        counts.append(count)
+                    lengths.append(sum(terms.values()))
+                    doc_file.append(file_index)
+                    doc_row.append(row)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        counts = np.asarray(counts, dtype=np.float32)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        num_docs = len(lengths)
+        avg_length = float(lengths.mean()) if num_docs else 0.0
+
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, doc_ids, counts = term_ids[order], doc_ids[order], counts[order]
+        doc_freq = np.bincount(term_ids, minlength=len(vocab)).astype(np.float32)
+        indptr = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+        idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = k1 * (1 - b + b * lengths[doc_ids] / avg_length) if num_docs else counts
+        weights = (idf[term_ids] * counts * (k1 + 1) / (counts + norm)).astype(np.float32)
+
+        meta = {"datasets": [os.path.abspath(path) for path in datasets], "fields": list(fields), "k1": k1, "b": b,
+                "documents": num_docs, "terms": len(vocab), "avg_length": avg_length}
+        return cls(vocab, indptr, doc_ids, weights, np.asarray(doc_file, dtype=np.int16),
+                   np.asarray(doc_row, dtype=np.int64), meta)
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        for name in ('indptr', 'docs', 'weights', 'doc_file', 'doc_row'):
+            np.save(os.path.join(index_dir, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(index_dir, 'vocab.json'), 'w', encoding='utf-8') as file:
+            json.dump(self.vocab, file, ensure_ascii=False)
+        with open(os.path.join(index_dir, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump(self.meta, file, ensure_ascii=False, indent=2)
+
+    # Arrays are memory-mapped, so loading costs the vocabulary parse and the pages a query touches
+    @classmethod
+    def load(cls, index_dir):
+        arrays = {name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+                  for name in ('indptr', 'docs', 'weights', 'doc_file', 'doc_row')}
+        with open(os.path.join(index_dir, 'vocab.json'), 'r', encoding='utf-8') as file:
+            vocab = json.load(file)
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        return cls(vocab, meta=meta, **arrays)
+
+    # Function to return the top-k (document, score) pairs for each query. Queries are scored in blocks into one
+    # dense (query, document) matrix: every posting slice is a contiguous read of the CSR arrays added to its
+    # query's row, and each row is then cut to its top k with argpartition.
+    def search(self, queries, k=10):
+        num_docs = len(self)
+        top = min(k, num_docs)
+        block = max(1, _BLOCK_CELLS // max(num_docs, 1))
+        results = []
+        for start in range(0, len(queries), block):
+            batch = queries[start:start + block]
+            scores = np.zeros((len(batch), num_docs), dtype=np.float32)
+            for row, query in zip(scores, batch):
+                for term, count in Counter(tokenize(query)).items():
+                    term_id = self.vocab.get(term)
+                    if term_id is not None:
+                        begin, end = self.indptr[term_id], self.indptr[term_id + 1]
+                        row[self.docs[begin:end]] += count * self.weights[begin:end]
+            if not top:
+                results.extend([] for _ in batch)
+                continue
+            best = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best, best_scores = np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+            for docs, doc_scores in zip(best, best_scores):
+                results.append([(int(doc), float(score)) for doc, score in zip(docs, doc_scores) if score > 0])
+        return results
+
+    # Function to decode the dataset record behind a document id
+    def record(self, doc):
+        file_index = int(self.doc_file[doc])
+        if file_index not in self._readers:
+            self._readers[file_index] = dataset_index.DatasetReader(self.meta['datasets'][file_index])
+        return self._readers[file_index][int(self.doc_row[doc])]
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a BM25 index over generated datasets, or query one')
+    parser.add_argument('--index-dir', default='./bm25_index')
+    parser.add_argument('--build', nargs='+', metavar='DATASET', default=None,
+                        help='JSONL datasets to index (qa, script or kl_output files)')
+    parser.add_argument('--fields', nargs='+', default=list(DEFAULT_FIELDS))
+    parser.add_argument('--query', action='append', default=[], help='Query to run; may be repeated')
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.build:
+        start = time.perf_counter()
+        index = BM25Index.build(args.build, fields=args.fields)
+        index.save(args.index_dir)
+        logging.info(f"Indexed {len(index)} records ({index.meta['terms']} terms) into {args.index_dir} "
+                     f"in {time.perf_counter() - start:.1f}s")
+    index = BM25Index.load(args.index_dir)
+    for query, hits in zip(args.query, index.search(args.query, k=args.k)):
+        print(f"# {query}")
+        for doc, score in hits:
+            print(f"{score:.3f}\t{json.dumps(index.record(doc), ensure_ascii=False)[:200]}")
+    index.close()
@@ -0,0 +1,260 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import zlib
+
+import numpy as np
+
+import bm25_index
+
+# Generated datasets are read through the offset index that lives next to the generation scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'generation'))
+import dataset_index
+
+# Record fields that are embedded
+DEFAULT_FIELDS = ('query', 'answer', 'script_name', 'definition_description', 'examples')
+# Rows scored per matrix multiply, which bounds the float32 copy made of an int8 block
+_BLOCK_ROWS = 1 << 16
+
+
+# Local embedder for offline use and tests: signed feature hashing of the BM25 terms into `dim` buckets, with
+# sublinear term frequencies and idf weights fitted on the first texts the index sees
+class HashingEmbedder:
+    name = 'hashing'
+
+    def __init__(self, dim=512, idf=None):
+        self.dim = dim
+        self.idf = idf
+
+    def _counts(self, texts):
+        counts = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(counts, texts):
+            hashes = np.fromiter((zlib.crc32(term.encode('utf-8')) for term in bm25_index.tokenize(text)),
+                                 dtype=np.int64)
+            signs = np.where(hashes & (1 << 31), -1.0, 1.0).astype(np.float32)
+            np.add.at(row, hashes % self.dim, signs)
+        return counts
+
+    def fit(self, texts):
+        doc_freq = (self._counts(texts) != 0).sum(axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + doc_freq)) + 1).astype(np.float32)
+
+    def __call__(self, texts):
+        vectors = self._counts(texts)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        if self.idf is not None:
+            vectors *= self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def spec(self):
+        return {"name": self.name, "dim": self.dim}
+
+    def save(self, index_dir):
+        if self.idf is not None:
+            np.save(os.path.join(index_dir, 'idf.npy'), self.idf)
+
+    @classmethod
+    def load(cls, spec, index_dir):
+        path = os.path.join(index_dir, 'idf.npy')
+        return cls(spec["dim"], np.load(path) if os.path.exists(path) else None)
+
+
+# Embeddings endpoint of the configured OpenAI-compatible API
+class OpenAIEmbedder:
+    name = 'openai'
+
+    def __init__(self, model='text-embedding-3-small', batch_size=256):
+        import openai_api
+        self.client = openai_api.client
+        self.model = model
+        self.batch_size = batch_size
+
+    def fit(self, texts):
+        pass
+
+    def __call__(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(item.embedding for item in response.data)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def spec(self):
+        return {"name": self.name, "model": self.model}
+
+    def save(self, index_dir):
+        pass
+
+    @classmethod
+    def load(cls, spec, index_dir):
+        return cls(spec["model"])
+
+
+EMBEDDERS = {embedder.name: embedder for embedder in (HashingEmbedder, OpenAIEmbedder)}
+
+
+def quantize(vectors):
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+# Dense vector index over generated datasets. Vectors are L2-normalized rows of `.npy` matrices (float32, or int8
+# with one scale per row), memory-mapped at load, and a batch of queries is scored with one matrix multiply per
+# block plus argpartition. Each update appends a segment holding only the dataset rows not indexed yet, so newly
+# generated records do not force a rebuild. Records are resolved through dataset_index like BM25Index.
+class VectorIndex:
+    def __init__(self, index_dir, embedder=None, quantized=False, fields=DEFAULT_FIELDS):
+        self.index_dir = index_dir
+        meta_path = os.path.join(index_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                self.meta = json.load(file)
+            spec = self.meta["embedder"]
+            self.embedder = EMBEDDERS[spec["name"]].load(spec, index_dir)
+        else:
+            self.embedder = embedder or HashingEmbedder()
+            self.meta = {"embedder": self.embedder.spec(), "quantized": quantized, "fields": list(fields),
+                         "datasets": [], "indexed_rows": [], "sources": [], "segments": 0}
+        self.segments = [self._load_segment(segment) for segment in range(self.meta["segments"])]
+        self._readers = {}
+
+    def __len__(self):
+        return sum(len(docs) for _, _, docs in self.segments)
+
+    def _segment_path(self, segment, name):
+        return os.path.join(self.index_dir, f'segment-{segment:05d}.{name}.npy')
+
+    def _load_segment(self, segment):
+        vectors = np.load(self._segment_path(segment, 'vectors'), mmap_mode='r')
+        scales = np.load(self._segment_path(segment, 'scales'), mmap_mode='r') if self.meta["quantized"] else None
+        # (dataset, row, source) per vector
+        docs = np.load(self._segment_path(segment, 'docs'), mmap_mode='r')
+        return vectors, scales, docs
+
+    # Function to embed every dataset row that is not in the index yet and append it as a new segment
+    def update(self, datasets, batch_size=1024):
+        texts, docs = [], []
+        for path in datasets:
+            path = os.path.abspath(path)
+            if path not in self.meta["datasets"]:
+                self.meta["datasets"].append(path)
+                self.meta["indexed_rows"].append(0)
+            file_index = self.meta["datasets"].index(path)
+            with dataset_index.DatasetReader(path) as reader:
+                indexed = self.meta["indexed_rows"][file_index]
+                if len(reader) < indexed:
+                    raise ValueError(f"{path} has fewer records than were indexed; rebuild the index")
+                for row in range(indexed, len(reader)):
+                    record = reader[row]
+                    source = str(record.get("source"))
+                    if source not in self.meta["sources"]:
+                        self.meta["sources"].append(source)
+                    texts.append(bm25_index.record_text(record, self.meta["fields"]))
+                    docs.append((file_index, row, self.meta["sources"].index(source)))
+                self.meta["indexed_rows"][file_index] = len(reader)
+        if not texts:
+            return 0
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        if not self.segments:
+            self.embedder.fit(texts)
+            self.embedder.save(self.index_dir)
+        vectors = np.concatenate([self.embedder(texts[start:start + batch_size])
+                                  for start in range(0, len(texts), batch_size)])
+        segment = len(self.segments)
+        if self.meta["quantized"]:
+            vectors, scales = quantize(vectors)
+            np.save(self._segment_path(segment, 'scales'), scales)
+        np.save(self._segment_path(segment, 'vectors'), vectors)
+        np.save(self._segment_path(segment, 'docs'), np.asarray(docs, dtype=np.int64))
+        # The segment only becomes part of the index once the metadata points at it
+        self.meta["segments"] = segment + 1
+        meta_path = os.path.join(self.index_dir, 'meta.json')
+        with open(f'{meta_path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.meta, file, ensure_ascii=False, indent=2)
+        os.replace(f'{meta_path}.tmp', meta_path)
+        self.segments.append(self._load_segment(segment))
+        logging.info(f"Indexed {len(texts)} new records into segment {segment} of {self.index_dir}")
+        return len(texts)
+
+    # Function to return the top-k (document, score) pairs for each query by cosine similarity, optionally only
+    # over records whose `source` is one of `sources` (names from load_data.doc_list)
+    def search(self, queries, k=10, sources=None):
+        query_vectors = self.embedder(list(queries))
+        allowed = None
+        if sources is not None:
+            allowed = [self.meta["sources"].index(source) for source in sources if source in self.meta["sources"]]
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_docs = np.empty((len(queries), 0), dtype=np.int64)
+        offset = 0
+        for vectors, scales, docs in self.segments:
+            for start in range(0, len(vectors), _BLOCK_ROWS):
+                block = np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+                scores = query_vectors @ block.T
+                if scales is not None:
+                    scores *= scales[start:start + _BLOCK_ROWS]
+                if allowed is not None:
+                    scores[:, ~np.isin(docs[start:start + _BLOCK_ROWS, 2], allowed)] = -np.inf
+                ids = np.broadcast_to(np.arange(offset + start, offset + start + len(block)), scores.shape)
+                best_scores = np.concatenate([best_scores, scores], axis=1)
+                best_docs = np.concatenate([best_docs, ids], axis=1)
+                if best_scores.shape[1] > k:
+                    top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                    best_scores = np.take_along_axis(best_scores, top, axis=1)
+                    best_docs = np.take_along_axis(best_docs, top, axis=1)
+            offset += len(vectors)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_docs = np.take_along_axis(best_docs, order, axis=1)
+        return [[(int(doc), float(score)) for doc, score in zip(docs, scores) if score > -np.inf]
+                for docs, scores in zip(best_docs, best_scores)]
+
+    # Function to decode the dataset record behind a document id
+    def record(self, doc):
+        for _, _, docs in self.segments:
+            if doc < len(docs):
+                file_index, row, _ = (int(value) for value in docs[doc])
+                break
+            doc -= len(docs)
+        else:
+            raise IndexError(doc)
+        if file_index not in self._readers:
+            self._readers[file_index] = dataset_index.DatasetReader(self.meta["datasets"][file_index])
+        return self._readers[file_index][row]
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or update a dense vector index over generated datasets')
+    parser.add_argument('--index-dir', default='./vector_index')
+    parser.add_argument('--update', nargs='+', metavar='DATASET', default=None,
+                        help='JSONL datasets whose new records are appended to the index')
+    parser.add_argument('--embedder', choices=sorted(EMBEDDERS), default='hashing',
+                        help='Embedder of a new index (an existing index keeps its own)')
+    parser.add_argument('--dim', type=int, default=512, help='Dimensions of the hashing embedder')
+    parser.add_argument('--int8', action='store_true', help='Store a new index as int8 with per-row scales')
+    parser.add_argument('--query', action='append', default=[], help='Query to run; may be repeated')
+    parser.add_argument('--source', action='append', default=None, help='Only return records of this source')
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    embedder = None
+    if not os.path.exists(os.path.join(args.index_dir, 'meta.json')):
+        embedder = HashingEmbedder(args.dim) if args.embedder == 'hashing' else OpenAIEmbedder()
+    index = VectorIndex(args.index_dir, embedder=embedder, quantized=args.int8)
+    if args.update:
+        index.update(args.update)
+    for query, hits in zip(args.query, index.search(args.query, k=args.k, sources=args.source)):
+        print(f"# {query}")
+        for doc, score in hits:
+            print(f"{score:.3f}\t{json.dumps(index.record(doc), ensure_ascii=False)[:200]}")
+    index.close()
@@ -1,22 +1,39 @@
+import argparse
 import logging
 import os
-import time
-import re
+import sys
 import pandas as pd
 import glob
-import json
-from tqdm import tqdm
-from openai import OpenAI
+from collections import Counter
+from openai import OpenAI, AsyncOpenAI
+from langchain.docstore.document import Document
+
+# Shared pipeline components live next to the generation scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'generation'))
+import async_engine
+import batch_api
+import dataset_writer
+import governor
+import json_salvage
+import llm_cache
+import manifest
+import metrics
 
 # Configuration
 CONFIG = {
     "api_key": os.environ.get("OPENAI_API_KEY"),
     "base_url": os.environ.get("OPENAI_API_URL"),
+    "model": "gpt-4o",
     "token_limit": 4096,
-    "retry_limit": 3
+    "retry_limit": 3,
+    "concurrency": int(os.environ.get("OPENAI_CONCURRENCY", 16))
 }
 
-client = OpenAI(api_key=CONFIG["api_key"], base_url=CONFIG["base_url"])
+# Retries are left to the governor, which sees every 429 and shares the backoff across requests
+client = OpenAI(api_key=CONFIG["api_key"], base_url=CONFIG["base_url"], max_retries=0)
+async_client = AsyncOpenAI(api_key=CONFIG["api_key"], base_url=CONFIG["base_url"], max_retries=0)
+cache = llm_cache.from_env()
+limiter = governor.from_env()
 
 PROMPTS = {
     'knowledge_advice_prompt': """
@@ -85,115 +102,224 @@ PROMPTS = {
 }
 
 
-def chat_gpt_api(content, flag):
+def build_prompts(content, flag):
     if flag == 'qa':
         sys_prompt = PROMPTS["knowledge_advice_prompt"]
     else:
         sys_prompt = PROMPTS["script_prompt"]
 
     user_prompt = content + "Response: \n ```json\n<your json is here>```"
-    while True:
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": sys_prompt},
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-            return completion.choices[0].message.content
-        except:
-            time.sleep(1)
-            continue
-
-
-def process_data(data):
-    pattern = r"```json\n(.*?)\n```"
-    match = re.search(pattern, data, re.DOTALL)
-    if match:
-        return match.group(1)
-    pattern = r"```\n(.*?)\n```"
-    match = re.search(pattern, data, re.DOTALL)
-    return match.group(1) if match else data
-
-
-def process_qa_data(queries, answers):
-    kl_query, kl_answer, kl_topic = [], [], []
-
-    for num in tqdm(range(len(queries)), desc="Processing QA data"):
-        retry_count = 0
-        while retry_count < CONFIG["retry_limit"]:
-            content = f"Question: {queries[num]}\n Answer: {answers[num]}"
-            response = chat_gpt_api(content, 'qa')
-            output = process_data(response)
+    return sys_prompt, user_prompt
 
-            try:
-                data = json.loads(output)
-                kl_query.append(data['knowledge_advice_question'])
-                kl_answer.append(data['knowledge_advice_answer'])
-                kl_topic.append(data['topic'])
-                break
-            except json.JSONDecodeError:
-                retry_count += 1
-                logging.warning(f"Retry {retry_count}/{CONFIG['retry_limit']} for QA query index {num}")
-                if retry_count == CONFIG["retry_limit"]:
-                    kl_query.append(None)
-                    kl_answer.append(None)
-                    kl_topic.append(None)
-    return kl_query, kl_answer, kl_topic
-
-
-def process_code_data(queries, answers, jsonl_file):
-    for num in tqdm(range(len(queries[:5])), desc="Processing Code data"):
-        retry_count = 0
-        while retry_count < CONFIG["retry_limit"]:
-            content = f"query: {queries[num]}\n code: {answers[num]}"
-            response = chat_gpt_api(content, 'code')
-            output = process_data(response)
 
-            try:
-                data = json.loads(output)
-                data['example'] = content
-                jsonl_file.write(json.dumps(data) + '\n')
-                break
-            except json.JSONDecodeError:
-                retry_count += 1
-                logging.warning(f"Retry {retry_count}/{CONFIG['retry_limit']} for Code query index {num}")
+# Function to look up a cached response; returns (cache key, response or None)
+def cached_response(sys_prompt, user_prompt, use_cache=True):
+    # `use_cache=False` skips the lookup so a response that failed to parse is fetched again
+    key = cache.key(CONFIG["model"], sys_prompt, user_prompt)
+    if use_cache:
+        response = cache.get(key)
+        if response is not None:
+            return key, response
+    elif cache.mode == 'replay':
+        raise llm_cache.CacheMiss(f"Cannot refresh {key} in replay mode")
+    else:
+        metrics.run.count('retries')
+    return key, None
 
 
-def main(input_path, output_path):
-    os.makedirs(output_path, exist_ok=True)
-    kl_result = []
-    csv_files = glob.glob(os.path.join(input_path, '**/*.csv'), recursive=True)
+def chat_gpt_api(content, flag, use_cache=True):
+    sys_prompt, user_prompt = build_prompts(content, flag)
+    key, response = cached_response(sys_prompt, user_prompt, use_cache)
+    if response is not None:
+        return response
+    completion = limiter.call(lambda: client.chat.completions.create(
+        model=CONFIG["model"],
+        messages=[
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    ), sys_prompt + user_prompt, CONFIG["model"])
+    response = completion.choices[0].message.content
+    cache.put(key, CONFIG["model"], response)
+    return response
+
+
+# Async variant of chat_gpt_api used by the concurrent conversion
+async def async_chat_gpt_api(content, flag, use_cache=True):
+    sys_prompt, user_prompt = build_prompts(content, flag)
+    key, response = cached_response(sys_prompt, user_prompt, use_cache)
+    if response is not None:
+        return response
+    completion = await limiter.call_async(lambda: async_client.chat.completions.create(
+        model=CONFIG["model"],
+        messages=[
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    ), sys_prompt + user_prompt, CONFIG["model"])
+    response = completion.choices[0].message.content
+    cache.put(key, CONFIG["model"], response)
+    return response
+
+
+# Input CSVs by file name: (flag, query column, answer column, prompt template)
+CSV_FORMATS = {
+    "Question-Answer": ('qa', 'Prompts', 'Answers', "Question: {}\n Answer: {}"),
+    "Prompt-Script": ('code', 'prompt', 'code', "query: {}\n code: {}"),
+}
+# json_salvage schema of each flag's completions
+FLAG_SCHEMAS = {'qa': 'knowledge_advice', 'code': 'code'}
+
+
+# Function to stream every CSV row as a Document, reading `chunk_rows` rows at a time. Rows are identified by
+# `<csv file>:<row index>`, which is what the run manifest records for --resume.
+def iter_rows(input_path, chunk_rows=1000):
+    csv_files = sorted(glob.glob(os.path.join(input_path, '**/*.csv'), recursive=True))
     for csv_file in csv_files:
-        # Process QA Data
-        if "Question-Answer" in csv_file:
-            df = pd.read_csv(csv_file).dropna()
-            queries, answers = df['Prompts'], df['Answers']
-            kl_query, kl_answer, kl_topic = process_qa_data(list(queries), list(answers))
+        source = os.path.relpath(csv_file, input_path)
+        for marker, (flag, query_column, answer_column, template) in CSV_FORMATS.items():
+            if marker not in csv_file:
+                continue
+            for frame in pd.read_csv(csv_file, chunksize=chunk_rows):
+                frame = frame.dropna()
+                for row, query, answer in zip(frame.index, frame[query_column], frame[answer_column]):
+                    yield Document(page_content=template.format(query, answer),
+                                   metadata={"chunk_id": f"{source}:{row}", "source": source, "flag": flag})
+
+
+# Function to turn a parsed completion into the output record for its row
+def to_record(data, flag, content):
+    if flag == 'qa':
+        return {
+            "type": "knowledge_advice",
+            "topic": data['topic'],
+            "query": data['knowledge_advice_question'],
+            "answer": data['knowledge_advice_answer'],
+        }
+    data['example'] = content
+    return data
+
+
+# Function to convert a single CSV row; returns None when the row could not be converted
+async def convert_row(row):
+    flag, content = row.metadata["flag"], row.page_content
+    for retry_count in range(CONFIG["retry_limit"]):
+        try:
+            response = await async_chat_gpt_api(content, flag, use_cache=retry_count == 0)
+            return [to_record(json_salvage.parse(response, FLAG_SCHEMAS[flag]), flag, content)]
+        except llm_cache.CacheMiss as e:
+            logging.warning(f"{e}, skipping row {row.metadata['chunk_id']}")
+            return None
+        except ValueError:
+            logging.warning(f"Retry {retry_count + 1}/{CONFIG['retry_limit']} for row {row.metadata['chunk_id']}")
+    return None
 
-            result_df = pd.DataFrame({
-                "type": ["knowledge_advice"]*len(kl_query),
-                "topic": kl_topic,
-                "query": kl_query,
-                "answer": kl_answer,
 
-            })
+# Function to convert every CSV row with `concurrency` requests in flight. Records are appended to kl_output.jsonl
+# or script_format.jsonl as rows finish, and a row is recorded in the manifest once its record is flushed, so
+# with `resume` an interrupted run only converts the rows that are missing.
+def main(input_path, output_path, concurrency=None, resume=False, chunk_rows=1000):
+    os.makedirs(output_path, exist_ok=True)
+    run_manifest = manifest.RunManifest(f'{output_path}/process_manifest.jsonl', resume=resume)
+    writers = {
+        'qa': dataset_writer.DatasetWriter(f'{output_path}/kl_output.jsonl', append=resume),
+        'code': dataset_writer.DatasetWriter(f'{output_path}/script_format.jsonl', append=resume),
+    }
 
-            kl_result.append(result_df)
-        # Process script Data
-        if "Prompt-Script" in csv_file:
-            df = pd.read_csv(csv_file).dropna()
-            queries, answers = df['prompt'], df['code']
-            with open(f'{output_path}/script_format.jsonl', 'a') as jsonl_file:
-                process_code_data(list(queries), list(answers), jsonl_file)
+    def write_records(row, records):
+        writers[row.metadata["flag"]].write_many(records, callback=lambda: run_manifest.mark_done(row, len(records)))
 
-    final_result = pd.concat(kl_result, ignore_index=True)
+    rows = (row for row in iter_rows(input_path, chunk_rows) if not run_manifest.is_done(row.metadata["chunk_id"]))
+    concurrency = concurrency or CONFIG["concurrency"]
+    try:
+        async_engine.run(rows, convert_row, write_records, concurrency=concurrency, desc='Converting rows',
+                         queue_size=4 * concurrency)
+    finally:
+        # Records already converted are flushed and recorded even if the run is interrupted
+        for writer in writers.values():
+            writer.close()
+        run_manifest.close()
 
-    final_result.to_json(f'{output_path}/kl_output.jsonl', orient='records', lines=True, force_ascii=False)
+
+# Function to write one Batch API request per CSV row. custom_ids are the row's `<csv file>:<row index>`, so they
+# are stable and two rows with the same content still get a request each.
+def batch_export(input_path, batch_dir):
+    exporter = batch_api.BatchExporter(batch_dir, 'trans_format', CONFIG["model"])
+    for row in iter_rows(input_path):
+        flag, content = row.metadata["flag"], row.page_content
+        custom_id = f"{flag}-{row.metadata['chunk_id']}"
+        sys_prompt, user_prompt = build_prompts(content, flag)
+        exporter.add(custom_id, sys_prompt, user_prompt, {"content": content})
+    exporter.close()
+
+
+# Function to parse downloaded Batch API results into kl_output.jsonl and script_format.jsonl
+def batch_ingest(batch_dir, output_path):
+    os.makedirs(output_path, exist_ok=True)
+    meta = batch_api.load_meta(batch_dir, 'trans_format')
+    results = {}
+    for custom_id, response, error in batch_api.read_results(batch_dir):
+        results[custom_id] = (response, error)
+
+    stats = Counter()
+    writers = {
+        'qa': dataset_writer.DatasetWriter(f'{output_path}/kl_output.jsonl', append=False),
+        'code': dataset_writer.DatasetWriter(f'{output_path}/script_format.jsonl', append=False),
+    }
+    try:
+        for custom_id, (response, error) in results.items():
+            flag = custom_id.split('-', 1)[0]
+            if custom_id not in meta or flag not in FLAG_SCHEMAS:
+                logging.warning(f"Unknown custom_id {custom_id} in batch results, skipping")
+                stats["unknown"] += 1
+                continue
+            if error is not None:
+                logging.warning(f"Batch request {custom_id} failed: {error}")
+                stats["failed"] += 1
+                continue
+            try:
+                record = to_record(json_salvage.parse(response, FLAG_SCHEMAS[flag]), flag, meta[custom_id]['content'])
+                writers[flag].write(record)
+                stats["ingested"] += 1
+            except ValueError as e:
+                logging.warning(f"Could not parse batch result {custom_id}: {e}")
+                stats["unparsable"] += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+    logging.info(f"Batch ingest: {dict(stats)}")
+    return stats
 
 
 if __name__ == '__main__':
-    input_path = './Non-Augmented_Data'
-    output_path = './processed_data'
-    main(input_path, output_path)
+    parser = argparse.ArgumentParser(description='Convert open-source QA datasets to the EDA Copilot format')
+    parser.add_argument('--input-path', default='./Non-Augmented_Data')
+    parser.add_argument('--output-path', default='./processed_data')
+    parser.add_argument('--batch', choices=['export', 'ingest'], default=None,
+                        help='Write Batch API request files instead of calling the API, or ingest downloaded results')
+    parser.add_argument('--batch-dir', default=None,
+                        help='Directory for batch request files; results go to <batch-dir>/results '
+                             '(default: <output-path>/batch)')
+    parser.add_argument('--concurrency', type=int, default=CONFIG["concurrency"],
+                        help='Number of API requests in flight')
+    parser.add_argument('--resume', action='store_true', help='Skip rows recorded in the run manifest')
+    parser.add_argument('--chunk-rows', type=int, default=1000, help='CSV rows read at a time')
+    parser.add_argument('--prometheus-textfile', default=None,
+                        help='Write the run metrics to this Prometheus textfile '
+                             '(default: <output-path>/process_metrics.prom)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    batch_dir = args.batch_dir or f'{args.output_path}/batch'
+
+    if args.batch == 'export':
+        batch_export(args.input_path, batch_dir)
+    elif args.batch == 'ingest':
+        batch_ingest(batch_dir, args.output_path)
+    else:
+        main(args.input_path, args.output_path, args.concurrency, args.resume, args.chunk_rows)
+    cache.log_stats()
+    json_salvage.log_stats()
+    metrics.run.write(f'{args.output_path}/process_run_report.json',
+                      args.prometheus_textfile or f'{args.output_path}/process_metrics.prom',
+                      {"cache": cache.stats(), "json_parsing": dict(json_salvage.stats)})
+    metrics.run.log_summary()